@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
 import sqlite3
 import os
@@ -10,6 +10,26 @@ import logging
 import time
 import random
 import re
+import threading
+import heapq
+import itertools
+import json
+import math
+import queue
+import atexit
+import functools
+import copy
+import sys
+import zlib
+import bisect
+import unicodedata
+import hmac
+import csv
+import io
+import click
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
 from groq import Groq
 import httpx # Added import
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode # Added for URL manipulation
@@ -42,6 +62,25 @@ def get_nested(data, keys, default=None):
             return default
     return data
 
+# Rooms assumed per hotel and room type when no room_inventory row has been configured
+DEFAULT_ROOMS_PER_TYPE = int(os.environ.get("DEFAULT_ROOMS_PER_TYPE", "10"))
+
+# Booking analytics are kept in booking_rollups, one row per (dimension, key), so dashboard reads are
+# primary-key or index lookups. Each entry is (key, label) SQL over bookings b; room nights count every
+# room of a multi-room booking.
+BOOKING_ROLLUP_DIMENSIONS = {
+    "all": ("'all'", "NULL"),
+    "city": ("COALESCE(LOWER(TRIM(b.city)), '')", "TRIM(b.city)"),
+    "hotel": ("COALESCE(b.hotel_id, b.hotel_name, '')", "b.hotel_name"),
+    "day": ("DATE(b.booking_date)", "NULL"),
+}
+BOOKING_ROOM_NIGHTS_SQL = ("CAST(julianday(b.check_out) - julianday(b.check_in) AS INTEGER) * "
+                           "COALESCE((SELECT SUM(r.rooms) FROM room_reservations AS r WHERE r.booking_id = b.id), 1)")
+
+# Raised by save_booking when the requested rooms are no longer free for the dates
+class RoomsUnavailableError(Exception):
+    pass
+
 # Database Manager Class
 class DatabaseManager:
     def __init__(self):
@@ -75,7 +114,241 @@ class DatabaseManager:
                     FOREIGN KEY(user_id) REFERENCES users(id)
                 )
             ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_bookings_user
+                ON bookings (user_id)
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS price_observations (
+                    id INTEGER PRIMARY KEY,
+                    hotel_id TEXT NOT NULL,
+                    hotel_name TEXT,
+                    destination TEXT,
+                    stay_date DATE NOT NULL,
+                    check_out DATE,
+                    observed_at DATETIME NOT NULL,
+                    total_price REAL,
+                    rate_per_night REAL,
+                    currency TEXT,
+                    source TEXT
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_price_observations_hotel_stay
+                ON price_observations (hotel_id, stay_date, observed_at)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_price_observations_destination_stay
+                ON price_observations (destination COLLATE NOCASE, stay_date)
+            ''')
+            # Local room inventory: capacity per hotel/room type and one reservation per booking.
+            # Reservations are indexed in an R*Tree on (hotel key, night) so overlap lookups only
+            # touch reservations of the requested hotels that intersect the requested nights.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS room_inventory (
+                    hotel_id TEXT NOT NULL,
+                    room_type TEXT NOT NULL,
+                    total_rooms INTEGER NOT NULL,
+                    PRIMARY KEY (hotel_id, room_type)
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS inventory_hotels (
+                    id INTEGER PRIMARY KEY,
+                    hotel_id TEXT UNIQUE NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS room_reservations (
+                    id INTEGER PRIMARY KEY,
+                    booking_id INTEGER,
+                    hotel_id TEXT NOT NULL,
+                    room_type TEXT NOT NULL,
+                    check_in DATE NOT NULL,
+                    check_out DATE NOT NULL,
+                    rooms INTEGER NOT NULL DEFAULT 1,
+                    FOREIGN KEY(booking_id) REFERENCES bookings(id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_room_reservations_booking
+                ON room_reservations (booking_id)
+            ''')
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS room_reservation_index
+                USING rtree_i32(id, hotel_min, hotel_max, night_min, night_max)
+            ''')
+            # Last known position and headline facts of every hotel seen in a SerpApi response,
+            # with an R*Tree over the coordinates for radius and map-bounds queries
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS hotel_locations (
+                    id INTEGER PRIMARY KEY,
+                    hotel_id TEXT NOT NULL UNIQUE,
+                    name TEXT,
+                    destination TEXT,
+                    latitude REAL NOT NULL,
+                    longitude REAL NOT NULL,
+                    rate_per_night REAL,
+                    overall_rating REAL,
+                    hotel_class INTEGER,
+                    thumbnail TEXT,
+                    updated_at DATETIME NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS hotel_location_index
+                USING rtree(id, min_lat, max_lat, min_lng, max_lng)
+            ''')
+            # Searchable text of every hotel seen in a SerpApi response, with an external-content FTS5
+            # index kept in step by triggers so each upsert only touches that hotel's index entries
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS hotel_documents (
+                    id INTEGER PRIMARY KEY,
+                    hotel_id TEXT NOT NULL UNIQUE,
+                    name TEXT,
+                    description TEXT,
+                    address TEXT,
+                    amenities TEXT,
+                    destination TEXT,
+                    rate_per_night REAL,
+                    overall_rating REAL,
+                    hotel_class INTEGER,
+                    thumbnail TEXT,
+                    updated_at DATETIME NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS hotel_text_index
+                USING fts5(name, description, address, amenities,
+                           content='hotel_documents', content_rowid='id', tokenize='porter unicode61')
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS hotel_documents_ai AFTER INSERT ON hotel_documents BEGIN
+                    INSERT INTO hotel_text_index (rowid, name, description, address, amenities)
+                    VALUES (new.id, new.name, new.description, new.address, new.amenities);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS hotel_documents_ad AFTER DELETE ON hotel_documents BEGIN
+                    INSERT INTO hotel_text_index (hotel_text_index, rowid, name, description, address, amenities)
+                    VALUES ('delete', old.id, old.name, old.description, old.address, old.amenities);
+                END
+            ''')
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS hotel_documents_au AFTER UPDATE ON hotel_documents BEGIN
+                    INSERT INTO hotel_text_index (hotel_text_index, rowid, name, description, address, amenities)
+                    VALUES ('delete', old.id, old.name, old.description, old.address, old.amenities);
+                    INSERT INTO hotel_text_index (rowid, name, description, address, amenities)
+                    VALUES (new.id, new.name, new.description, new.address, new.amenities);
+                END
+            ''')
+            # Responses to POST /api/bookings keyed by the client's Idempotency-Key header;
+            # status_code stays NULL while the first attempt is still running
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    idempotency_key TEXT PRIMARY KEY,
+                    request_hash TEXT NOT NULL,
+                    status_code INTEGER,
+                    response_body TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created
+                ON idempotency_keys (created_at)
+            ''')
+            # Background payment/booking jobs; result holds the JSON body the job finished with
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS booking_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    status_code INTEGER,
+                    result TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            # Written by the post-booking background tasks
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS booking_confirmations (
+                    booking_id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    transaction_id INTEGER,
+                    confirmation_code TEXT NOT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (booking_id) REFERENCES bookings (id)
+                )
+            ''')
+            # Bumped by triggers on every write to a user's bookings, from any process (API, Streamlit,
+            # bulk import), so cached booking lists can be keyed by version instead of invalidated
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS booking_versions (
+                    user_id INTEGER PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )
+            ''')
+            for event, row in (("INSERT", "new"), ("DELETE", "old"), ("UPDATE", "old"), ("UPDATE", "new")):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS bookings_version_{event.lower()}_{row} AFTER {event} ON bookings
+                    WHEN {row}.user_id IS NOT NULL BEGIN
+                        INSERT INTO booking_versions (user_id, version) VALUES ({row}.user_id, 1)
+                        ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+                    END
+                ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS booking_counters (
+                    counter TEXT PRIMARY KEY,
+                    value REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS booking_rollups (
+                    dimension TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    label TEXT,
+                    bookings INTEGER NOT NULL DEFAULT 0,
+                    room_nights INTEGER NOT NULL DEFAULT 0,
+                    revenue REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (dimension, key)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_booking_rollups_revenue
+                ON booking_rollups (dimension, revenue DESC)
+            ''')
+            # Search counts per destination for DestinationIndex, so startup does not aggregate price_observations
+            cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM sqlite_master WHERE name = 'destination_searches')")
+            backfill_destinations = cursor.fetchone()[0]
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS destination_searches (
+                    destination TEXT PRIMARY KEY COLLATE NOCASE,
+                    searches INTEGER NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            # SerpApi calls per month ("month:2024-05") and per second for the last hour ("second:2024-05-01T12:00:00"),
+            # counted by UpstreamScheduler across processes and restarts
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS upstream_calls (
+                    period TEXT PRIMARY KEY,
+                    calls INTEGER NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            # Client rate limit buckets, only used when RATE_LIMIT_PERSIST is set
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                    bucket_key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            # WAL lets the background writers append while requests keep reading; the pragma returns a
+            # row that has to be read, or later commits on this connection fail with statements in progress
+            cursor.execute('PRAGMA journal_mode=WAL').fetchall()
             conn.commit()
+            self._backfill_reservations(conn)
+            self._backfill_rollups(conn)
+            if backfill_destinations:
+                self._backfill_destination_searches(conn)
         except sqlite3.Error as e:
             logging.error(f"Database error during table creation: {e}")
         finally:
@@ -132,81 +405,1918 @@ class DatabaseManager:
         finally:
             conn.close()
 
-    def save_booking(self, user_id, hotel_name, hotel_id, city, check_in, check_out, room_type, total_price):
+    # Reserves rooms for bookings made before the inventory tables existed (future stays only)
+    def _backfill_reservations(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT b.id, b.hotel_id, b.room_type, b.check_in, b.check_out
+                FROM bookings b LEFT JOIN room_reservations r ON r.booking_id = b.id
+                WHERE r.id IS NULL AND b.check_out > date('now') AND b.hotel_id IS NOT NULL
+            ''')
+            missing = cursor.fetchall()
+            for booking_id, hotel_id, room_type, check_in, check_out in missing:
+                self._insert_reservation(cursor, booking_id, hotel_id, room_type or "Standard Room", check_in, check_out, 1)
+            conn.commit()
+            if missing:
+                logging.info(f"Backfilled room reservations for {len(missing)} existing bookings")
+        except (sqlite3.Error, ValueError) as e:
+            conn.rollback()
+            logging.error(f"Database error during reservation backfill: {e}")
+
+    # Rollups are rebuilt when their booking count does not match the bookings table, e.g. for databases
+    # that had bookings before the rollups existed or bookings written by an older app.py
+    def _backfill_rollups(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT COALESCE((SELECT bookings FROM booking_rollups WHERE dimension = 'all' AND key = 'all'), 0)
+                       != (SELECT COUNT(*) FROM bookings)
+            ''')
+            if cursor.fetchone()[0]:
+                self._rebuild_rollups(cursor)
+                logging.info("Rebuilt booking rollups to match existing bookings")
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            logging.error(f"Database error during booking rollup backfill: {e}")
+
+    # Databases from before destination_searches existed get their counts from price_observations, once
+    def _backfill_destination_searches(self, conn):
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO destination_searches (destination, searches)
+                    SELECT destination, COUNT(DISTINCT observed_at)
+                    FROM price_observations
+                    WHERE destination IS NOT NULL AND source = 'search'
+                    GROUP BY destination
+                    ON CONFLICT(destination) DO UPDATE SET searches = searches + excluded.searches
+                ''')
+        except sqlite3.Error as e:
+            logging.error(f"Database error during destination search backfill: {e}")
+
+    # Integer key of a hotel in room_reservation_index, created on first use when create=True
+    def get_hotel_key(self, cursor, hotel_id, create=False):
+        cursor.execute('SELECT id FROM inventory_hotels WHERE hotel_id = ?', (hotel_id,))
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+        if not create:
+            return None
+        cursor.execute('INSERT INTO inventory_hotels (hotel_id) VALUES (?)', (hotel_id,))
+        return cursor.lastrowid
+
+    def _insert_reservation(self, cursor, booking_id, hotel_id, room_type, check_in, check_out, rooms):
+        cursor.execute('''
+            INSERT INTO room_reservations (booking_id, hotel_id, room_type, check_in, check_out, rooms)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (booking_id, hotel_id, room_type, check_in, check_out, rooms))
+        hotel_key = self.get_hotel_key(cursor, hotel_id, create=True)
+        # Nights are stored as date ordinals; a stay occupies check_in .. check_out - 1
+        cursor.execute('INSERT INTO room_reservation_index VALUES (?, ?, ?, ?, ?)',
+                       (cursor.lastrowid, hotel_key, hotel_key,
+                        date.fromisoformat(check_in).toordinal(), date.fromisoformat(check_out).toordinal() - 1))
+
+    # Free rooms per hotel for the nights [check_in, check_out), answered for all hotels at once
+    def _available_rooms(self, cursor, hotel_ids, check_in, check_out, room_type):
+        first_night = date.fromisoformat(check_in).toordinal()
+        last_night = date.fromisoformat(check_out).toordinal() - 1
+        nights = last_night - first_night + 1
+        hotel_ids = list(dict.fromkeys(hotel_ids))
+        placeholders = ",".join("(?)" for _ in hotel_ids)
+        cursor.execute(f'''
+            WITH page(hotel_id) AS (VALUES {placeholders})
+            SELECT page.hotel_id, i.night_min, i.night_max, r.rooms
+            FROM page
+            JOIN inventory_hotels h ON h.hotel_id = page.hotel_id
+            JOIN room_reservation_index i
+                ON i.hotel_min = h.id AND i.hotel_max = h.id AND i.night_min <= ? AND i.night_max >= ?
+            JOIN room_reservations r ON r.id = i.id
+            WHERE r.room_type = ?
+        ''', (*hotel_ids, last_night, first_night, room_type))
+        # Difference array per hotel gives the busiest night in the range
+        occupancy = {}
+        for hotel_id, night_min, night_max, rooms in cursor.fetchall():
+            changes = occupancy.setdefault(hotel_id, [0] * (nights + 1))
+            changes[max(night_min, first_night) - first_night] += rooms
+            changes[min(night_max, last_night) - first_night + 1] -= rooms
+        cursor.execute(f'''
+            SELECT hotel_id, total_rooms FROM room_inventory
+            WHERE room_type = ? AND hotel_id IN ({",".join("?" for _ in hotel_ids)})
+        ''', (room_type, *hotel_ids))
+        capacity = dict(cursor.fetchall())
+        available = {}
+        for hotel_id in hotel_ids:
+            peak = max(itertools.accumulate(occupancy[hotel_id][:-1])) if hotel_id in occupancy else 0
+            available[hotel_id] = max(0, capacity.get(hotel_id, DEFAULT_ROOMS_PER_TYPE) - peak)
+        return available
+
+    def get_available_rooms(self, hotel_ids, check_in, check_out, room_type="Standard Room"):
+        if not hotel_ids:
+            return {}
+        conn = sqlite3.connect('hotel_booking.db')
+        try:
+            return self._available_rooms(conn.cursor(), hotel_ids, check_in, check_out, room_type)
+        except sqlite3.Error as e:
+            logging.error(f"Database error during availability lookup: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def set_room_inventory(self, hotel_id, room_type, total_rooms):
         conn = sqlite3.connect('hotel_booking.db')
         try:
             cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO room_inventory (hotel_id, room_type, total_rooms) VALUES (?, ?, ?)
+                ON CONFLICT(hotel_id, room_type) DO UPDATE SET total_rooms = excluded.total_rooms
+            ''', (hotel_id, room_type, total_rooms))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            logging.error(f"Database error during inventory update: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def save_booking(self, user_id, hotel_name, hotel_id, city, check_in, check_out, room_type, total_price, rooms=1):
+        # Autocommit mode so BEGIN IMMEDIATE below controls the transaction
+        conn = sqlite3.connect('hotel_booking.db', timeout=30, isolation_level=None)
+        try:
+            cursor = conn.cursor()
+            # Take the write lock before checking, so two requests cannot both get the last room
+            cursor.execute('BEGIN IMMEDIATE')
+            available = self._available_rooms(cursor, [hotel_id], check_in, check_out, room_type)[hotel_id]
+            if available < rooms:
+                cursor.execute('ROLLBACK')
+                raise RoomsUnavailableError(f"Only {available} room(s) left for {hotel_id} between {check_in} and {check_out}")
             cursor.execute('''
                 INSERT INTO bookings (user_id, hotel_name, hotel_id, city, check_in, check_out, room_type, total_price)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ''', (user_id, hotel_name, hotel_id, city, check_in, check_out, room_type, total_price))
-            conn.commit()
-            return cursor.lastrowid
+            booking_id = cursor.lastrowid
+            self._insert_reservation(cursor, booking_id, hotel_id, room_type, check_in, check_out, rooms)
+            self._add_to_rollups(cursor, booking_id)
+            cursor.execute('COMMIT')
+            return booking_id
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            logging.error(f"Database error during booking save: {e}")
+            return None
+        finally:
+            conn.close()
+
+    # Yields bookings in id order, chunk_size rows per fetch, so exports never hold the whole table.
+    # The connection stays open until the generator is exhausted or closed.
+    def iter_bookings(self, user_id=None, first_day=None, last_day=None, chunk_size=1000):
+        conn = sqlite3.connect('hotel_booking.db')
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT b.id, b.user_id, b.hotel_name, b.hotel_id, b.city, b.check_in, b.check_out, b.room_type,
+                       COALESCE((SELECT SUM(r.rooms) FROM room_reservations AS r WHERE r.booking_id = b.id), 1),
+                       b.total_price, b.booking_date
+                FROM bookings AS b
+                WHERE (? IS NULL OR b.user_id = ?) AND DATE(b.booking_date) BETWEEN ? AND ?
+                ORDER BY b.id
+            ''', (user_id, user_id, first_day or '0000-01-01', last_day or '9999-12-31'))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    # Adds one committed booking to every rollup, inside the caller's transaction
+    def _add_to_rollups(self, cursor, booking_id):
+        for dimension, (key_sql, label_sql) in BOOKING_ROLLUP_DIMENSIONS.items():
+            cursor.execute(f'''
+                INSERT INTO booking_rollups (dimension, key, label, bookings, room_nights, revenue)
+                SELECT ?, {key_sql}, {label_sql}, 1, {BOOKING_ROOM_NIGHTS_SQL}, COALESCE(b.total_price, 0)
+                FROM bookings AS b WHERE b.id = ?
+                ON CONFLICT(dimension, key) DO UPDATE SET
+                    label = COALESCE(excluded.label, label),
+                    bookings = bookings + excluded.bookings,
+                    room_nights = room_nights + excluded.room_nights,
+                    revenue = revenue + excluded.revenue
+            ''', (dimension, booking_id))
+
+    def _rebuild_rollups(self, cursor):
+        cursor.execute('DELETE FROM booking_rollups')
+        for dimension, (key_sql, label_sql) in BOOKING_ROLLUP_DIMENSIONS.items():
+            cursor.execute(f'''
+                INSERT INTO booking_rollups (dimension, key, label, bookings, room_nights, revenue)
+                SELECT ?, {key_sql} AS rollup_key, MAX({label_sql}), COUNT(*), SUM({BOOKING_ROOM_NIGHTS_SQL}),
+                       SUM(COALESCE(b.total_price, 0))
+                FROM bookings AS b
+                GROUP BY rollup_key
+            ''', (dimension,))
+
+    # Recomputes every rollup from the bookings table in one transaction; returns the number of rollup rows
+    def rebuild_booking_rollups(self):
+        conn = sqlite3.connect('hotel_booking.db', timeout=30, isolation_level=None)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            self._rebuild_rollups(cursor)
+            cursor.execute('SELECT COUNT(*) FROM booking_rollups')
+            count = cursor.fetchone()[0]
+            cursor.execute('COMMIT')
+            return count
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    # Top rollup rows of a dimension by revenue, or the day rows between first_day and last_day
+    def get_booking_rollups(self, dimension, limit=20, first_day=None, last_day=None):
+        conn = sqlite3.connect('hotel_booking.db')
+        try:
+            cursor = conn.cursor()
+            if dimension == "day":
+                cursor.execute('''
+                    SELECT key, label, bookings, room_nights, revenue FROM booking_rollups
+                    WHERE dimension = 'day' AND key BETWEEN ? AND ?
+                    ORDER BY key
+                    LIMIT ?
+                ''', (first_day or '0000-01-01', last_day or '9999-12-31', limit))
+            else:
+                cursor.execute('''
+                    SELECT key, label, bookings, room_nights, revenue FROM booking_rollups
+                    WHERE dimension = ?
+                    ORDER BY revenue DESC
+                    LIMIT ?
+                ''', (dimension, limit))
+            return [{
+                "key": row[0],
+                "label": row[1],
+                "bookings": row[2],
+                "room_nights": row[3],
+                "revenue": round(row[4], 2),
+                "avg_nightly_price": round(row[4] / row[3], 2) if row[3] else None
+            } for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logging.error(f"Database error during fetching booking rollups: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def get_user_bookings_version(self, user_id):
+        conn = sqlite3.connect('hotel_booking.db')
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT version FROM booking_versions WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        except sqlite3.Error as e:
+            logging.error(f"Database error during fetching bookings version: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def get_user_bookings(self, user_id):
+        conn = sqlite3.connect('hotel_booking.db')
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, user_id, hotel_name, city, check_in, check_out, room_type, total_price, booking_date, hotel_id
+                FROM bookings
+                WHERE user_id = ? ORDER BY booking_date DESC
+            ''', (user_id,))
+            bookings = cursor.fetchall()
+            result = []
+            for booking in bookings:
+                result.append({
+                    "id": booking[0],
+                    "user_id": booking[1],
+                    "hotel_name": booking[2],
+                    "city": booking[3],
+                    "check_in": booking[4],
+                    "check_out": booking[5],
+                    "room_type": booking[6],
+                    "total_price": booking[7],
+                    "booking_date": booking[8],
+                    "hotel_id": booking[9]
+                })
+            return result
+        except sqlite3.Error as e:
+            logging.error(f"Database error during fetching bookings: {e}")
+            return []
+        finally:
+            conn.close()
+
+    # Average observed nightly rate per hotel for a destination and check-in date, for hotels
+    # not in exclude_ids; used as the market reference for deal scores
+    def get_destination_rates(self, destination, stay_date, exclude_ids=(), max_age_days=30):
+        conn = sqlite3.connect('hotel_booking.db')
+        try:
+            exclude_ids = list(exclude_ids)
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT AVG(rate_per_night)
+                FROM price_observations
+                WHERE destination = ? COLLATE NOCASE AND stay_date = ? AND rate_per_night IS NOT NULL
+                      AND observed_at >= datetime('now', ?)
+                      AND hotel_id NOT IN ({",".join("?" * len(exclude_ids))})
+                GROUP BY hotel_id
+            ''', [destination, stay_date, f'-{max_age_days} days'] + exclude_ids)
+            return [row[0] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logging.error(f"Database error during fetching destination rates: {e}")
+            return []
+        finally:
+            conn.close()
+
+    # Hotels inside the box, nearest to (lat, lng) first by an equirectangular estimate, so a limit
+    # drops the farthest candidates rather than arbitrary ones
+    def get_hotels_in_box(self, south, north, west, east, lat, lng, limit=1000):
+        conn = sqlite3.connect('hotel_booking.db')
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT l.hotel_id, l.name, l.destination, l.latitude, l.longitude, l.rate_per_night,
+                       l.overall_rating, l.hotel_class, l.thumbnail, l.updated_at
+                FROM hotel_location_index AS i
+                JOIN hotel_locations AS l ON l.id = i.id
+                WHERE i.max_lat >= ? AND i.min_lat <= ? AND i.max_lng >= ? AND i.min_lng <= ?
+                ORDER BY (l.latitude - ?) * (l.latitude - ?) + (l.longitude - ?) * (l.longitude - ?) * ?
+                LIMIT ?
+            ''', (south, north, west, east, lat, lat, lng, lng, float(np.cos(np.radians(lat))) ** 2, limit))
+            columns = ("property_token", "name", "destination", "latitude", "longitude", "rate_per_night",
+                       "overall_rating", "hotel_class", "thumbnail", "updated_at")
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logging.error(f"Database error during nearby hotel lookup: {e}")
+            return None
+        finally:
+            conn.close()
+
+    # match is an FTS5 query; bm25 weights favour name, then amenities, address and description
+    def search_hotel_text(self, match, destination=None, limit=20):
+        conn = sqlite3.connect('hotel_booking.db')
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT d.hotel_id, d.name, d.destination, d.address, d.rate_per_night, d.overall_rating,
+                       d.hotel_class, d.thumbnail, d.updated_at,
+                       snippet(hotel_text_index, 1, '[', ']', '...', 12),
+                       bm25(hotel_text_index, 8.0, 1.0, 2.0, 4.0) AS score
+                FROM hotel_text_index
+                JOIN hotel_documents AS d ON d.id = hotel_text_index.rowid
+                WHERE hotel_text_index MATCH ? AND (? IS NULL OR d.destination = ? COLLATE NOCASE)
+                ORDER BY score
+                LIMIT ?
+            ''', (match, destination, destination, limit))
+            columns = ("property_token", "name", "destination", "address", "rate_per_night", "overall_rating",
+                       "hotel_class", "thumbnail", "updated_at", "snippet")
+            return [dict(zip(columns, row[:-1]), score=round(-row[-1], 4)) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            logging.error(f"Database error during hotel text search: {e}")
+            return None
+        finally:
+            conn.close()
+
+    # Destinations that earlier searches found hotels for, with the number of searches, most searched first.
+    # Rows past the limit are deleted, which keeps the table small.
+    def get_searched_destinations(self, limit=5000):
+        conn = sqlite3.connect('hotel_booking.db', timeout=30)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT destination, searches FROM destination_searches
+                ORDER BY searches DESC
+            ''')
+            rows = cursor.fetchall()
+            with conn:
+                conn.executemany('DELETE FROM destination_searches WHERE destination = ?', [row[:1] for row in rows[limit:]])
+            return rows[:limit]
+        except sqlite3.Error as e:
+            logging.error(f"Database error during fetching searched destinations: {e}")
+            return []
+        finally:
+            conn.close()
+
+    # Counts one search that found hotels for a destination; runs on the task runner
+    def record_destination_search(self, destination):
+        conn = sqlite3.connect('hotel_booking.db', timeout=30)
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO destination_searches (destination, searches) VALUES (?, 1)
+                    ON CONFLICT(destination) DO UPDATE SET searches = searches + 1
+                ''', (destination,))
+        finally:
+            conn.close()
+
+    def get_price_history(self, hotel_id, stay_from=None, stay_to=None, limit=500):
+        conn = sqlite3.connect('hotel_booking.db')
+        try:
+            cursor = conn.cursor()
+            stay_from = stay_from or '0000-01-01'
+            stay_to = stay_to or '9999-12-31'
+            cursor.execute('''
+                SELECT stay_date, check_out, observed_at, total_price, rate_per_night, currency, source
+                FROM price_observations
+                WHERE hotel_id = ? AND stay_date BETWEEN ? AND ?
+                ORDER BY stay_date, observed_at
+                LIMIT ?
+            ''', (hotel_id, stay_from, stay_to, limit))
+            observations = [{
+                "stay_date": row[0],
+                "check_out": row[1],
+                "observed_at": row[2],
+                "total_price": row[3],
+                "rate_per_night": row[4],
+                "currency": row[5],
+                "source": row[6]
+            } for row in cursor.fetchall()]
+            # Per stay date summary; the bare columns come from the MAX(observed_at) row in SQLite
+            cursor.execute('''
+                SELECT stay_date, COUNT(*), MIN(rate_per_night), MAX(rate_per_night), AVG(rate_per_night),
+                       MIN(observed_at), MAX(observed_at), rate_per_night, total_price
+                FROM price_observations
+                WHERE hotel_id = ? AND stay_date BETWEEN ? AND ?
+                GROUP BY stay_date
+                ORDER BY stay_date
+            ''', (hotel_id, stay_from, stay_to))
+            trend = [{
+                "stay_date": row[0],
+                "observations": row[1],
+                "min_rate_per_night": row[2],
+                "max_rate_per_night": row[3],
+                "avg_rate_per_night": round(row[4], 2) if row[4] is not None else None,
+                "first_observed_at": row[5],
+                "last_observed_at": row[6],
+                "latest_rate_per_night": row[7],
+                "latest_total_price": row[8]
+            } for row in cursor.fetchall()]
+            return {"observations": observations, "trend": trend}
+        except sqlite3.Error as e:
+            logging.error(f"Database error during fetching price history: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def get_user_id(self, username):
+        conn = sqlite3.connect('hotel_booking.db')
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+            result = cursor.fetchone()
+            return result[0] if result else None
+        except sqlite3.Error as e:
+            logging.error(f"Database error during fetching user ID: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def ensure_demo_user_exists(self):
+        demo_username = "demouser"
+        demo_password = "password" # Plain text, will be hashed by register_user
+        demo_email = "demo@example.com"
+        demo_full_name = "Demo User"
+
+        if not self.user_exists(demo_username):
+            logging.info(f"Attempting to create demo user: {demo_username}")
+            if self.register_user(demo_username, demo_password, demo_email, demo_full_name):
+                logging.info(f"Demo user '{demo_username}' created successfully.")
+            else:
+                # This might happen if email is taken but username wasn't, or other db error
+                logging.error(f"Failed to create demo user '{demo_username}' during ensure_demo_user_exists.")
+        else:
+            logging.info(f"Demo user '{demo_username}' already exists.")
+
+# Priority classes for upstream (SerpApi) calls, lower value = served first
+PRIORITY_INTERACTIVE = 0  # user-facing searches
+PRIORITY_DETAIL = 1       # single property lookups
+PRIORITY_PREFETCH = 2     # prefetching / cache warming
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_DETAIL: "detail", PRIORITY_PREFETCH: "prefetch"}
+# How long a call of each class may wait in the queue before it is dropped (seconds)
+PRIORITY_DEADLINES = {PRIORITY_INTERACTIVE: 8.0, PRIORITY_DETAIL: 10.0, PRIORITY_PREFETCH: 30.0}
+
+# Raised when an upstream call cannot be scheduled (queue full, deadline, quota or SerpApi 429)
+class UpstreamBusyError(Exception):
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after))
+
+# Token-bucket scheduler shared by every SerpApi call
+class UpstreamScheduler:
+    def __init__(self, rate_per_sec, burst, monthly_quota=None, max_queue=50, quota_reserve=0.1):
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self.monthly_quota = monthly_quota
+        self.max_queue = max_queue
+        self.quota_reserve = quota_reserve # Fraction of the monthly quota kept back from prefetch work
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0 # Set when SerpApi answers 429
+        self.condition = threading.Condition()
+        self.waiters = [] # Heap of [priority, deadline, seq, state]
+        self.sequence = itertools.count()
+        self.month = date.today().strftime("%Y-%m")
+        self.month_calls = 0 # Last count read from upstream_calls, for the fast quota check in acquire
+        self.counters = {name: {"granted": 0, "shed": 0, "expired": 0} for name in PRIORITY_NAMES.values()}
+
+    def _refill(self, now):
+        elapsed = now - self.last_refill
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate_per_sec)
+        self.last_refill = now
+
+    def _remaining_quota(self):
+        current_month = date.today().strftime("%Y-%m")
+        if current_month != self.month:
+            self.month = current_month
+            self.month_calls = 0
+        if not self.monthly_quota:
+            return None
+        return self.monthly_quota - self.month_calls
+
+    def _check_quota(self, priority):
+        remaining = self._remaining_quota()
+        if remaining is None:
+            return
+        if remaining <= 0:
+            raise UpstreamBusyError("Monthly SerpApi quota exhausted", retry_after=3600)
+        if priority == PRIORITY_PREFETCH and remaining <= self.monthly_quota * self.quota_reserve:
+            raise UpstreamBusyError("SerpApi quota reserved for interactive traffic", retry_after=3600)
+
+    # Counts a granted call in upstream_calls, which every worker process shares and which survives restarts.
+    # The quota is checked against the stored count in the same transaction, so processes cannot overspend it.
+    def _record_call(self, priority):
+        now = datetime.now()
+        conn = sqlite3.connect('hotel_booking.db', timeout=5, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT calls FROM upstream_calls WHERE period = ?', (f"month:{now:%Y-%m}",)).fetchone()
+            self.month, self.month_calls = f"{now:%Y-%m}", row[0] if row else 0
+            self._check_quota(priority)
+            conn.executemany('''
+                INSERT INTO upstream_calls (period, calls) VALUES (?, 1)
+                ON CONFLICT(period) DO UPDATE SET calls = calls + 1
+            ''', [(f"month:{now:%Y-%m}",), (f"second:{now:%Y-%m-%dT%H:%M:%S}",)])
+            conn.execute("DELETE FROM upstream_calls WHERE period >= 'second:' AND period < ?",
+                         (f"second:{now - timedelta(hours=1):%Y-%m-%dT%H:%M:%S}",))
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            logging.error(f"Database error during upstream call accounting: {e}")
+        finally:
+            conn.close()
+        self.month_calls += 1
+
+    # Calls this month, in the last minute and in the last hour, from upstream_calls
+    def _read_usage(self, now):
+        conn = sqlite3.connect('hotel_booking.db')
+        try:
+            row = conn.execute('SELECT calls FROM upstream_calls WHERE period = ?', (f"month:{now:%Y-%m}",)).fetchone()
+            seconds = conn.execute("SELECT period, calls FROM upstream_calls WHERE period BETWEEN ? AND 'second:~'",
+                                   (f"second:{now - timedelta(hours=1):%Y-%m-%dT%H:%M:%S}",)).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Database error during reading upstream usage: {e}")
+            return self.month_calls, None, None
+        finally:
+            conn.close()
+        minute_ago = f"second:{now - timedelta(minutes=1):%Y-%m-%dT%H:%M:%S}"
+        return (row[0] if row else 0, sum(calls for period, calls in seconds if period >= minute_ago),
+                sum(calls for _, calls in seconds))
+
+    def _shed(self, priority, message, retry_after):
+        self.counters[PRIORITY_NAMES[priority]]["shed"] += 1
+        logging.warning(f"Upstream scheduler shed {PRIORITY_NAMES[priority]} call: {message}")
+        raise UpstreamBusyError(message, retry_after=retry_after)
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, timeout=None):
+        timeout = timeout if timeout is not None else PRIORITY_DEADLINES[priority]
+        with self.condition:
+            now = time.monotonic()
+            deadline = now + timeout
+            self._refill(now)
+            try:
+                self._check_quota(priority)
+            except UpstreamBusyError as e:
+                self._shed(priority, str(e), e.retry_after)
+
+            # Fail fast if the calls already queued ahead of us cannot drain before our deadline
+            ahead = sum(1 for w in self.waiters if w[0] <= priority)
+            expected_wait = max(0.0, self.paused_until - now) + max(0.0, (ahead + 1 - self.tokens) / self.rate_per_sec)
+            if expected_wait > timeout:
+                self._shed(priority, "Upstream queue cannot be served before the deadline", expected_wait)
+
+            if len(self.waiters) >= self.max_queue:
+                # Make room by dropping the least important waiter, if it ranks below us
+                victim = max(self.waiters, key=lambda w: (w[0], w[1]))
+                if victim[0] <= priority:
+                    self._shed(priority, "Upstream queue is full", expected_wait)
+                victim[3] = "shed"
+                self.waiters.remove(victim)
+                heapq.heapify(self.waiters)
+                self.condition.notify_all()
+
+            entry = [priority, deadline, next(self.sequence), "waiting"]
+            heapq.heappush(self.waiters, entry)
+            while True:
+                if entry[3] == "shed":
+                    self._shed(priority, "Displaced by higher-priority upstream work", 1)
+                now = time.monotonic()
+                self._refill(now)
+                if self.waiters[0] is entry and self.tokens >= 1 and now >= self.paused_until:
+                    heapq.heappop(self.waiters)
+                    self.condition.notify_all()
+                    try:
+                        self._record_call(priority)
+                    except UpstreamBusyError as e:
+                        self._shed(priority, str(e), e.retry_after)
+                    self.tokens -= 1
+                    self.counters[PRIORITY_NAMES[priority]]["granted"] += 1
+                    return
+                if now >= deadline:
+                    self.waiters.remove(entry)
+                    heapq.heapify(self.waiters)
+                    self.counters[PRIORITY_NAMES[priority]]["expired"] += 1
+                    self.condition.notify_all()
+                    raise UpstreamBusyError("Timed out waiting for an upstream slot", retry_after=1)
+                wait_for = deadline - now
+                if self.waiters[0] is entry:
+                    wait_for = min(wait_for, max(self.paused_until - now, (1 - self.tokens) / self.rate_per_sec))
+                self.condition.wait(max(0.01, wait_for))
+
+    # Called when SerpApi itself answers 429: stop issuing tokens for a while
+    def penalize(self, retry_after):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.tokens = 0.0
+        logging.warning(f"SerpApi rate limited us, pausing upstream calls for {retry_after}s")
+
+    def get_stats(self):
+        now = datetime.now()
+        month_calls, calls_last_minute, calls_last_hour = self._read_usage(now)
+        with self.condition:
+            self.month, self.month_calls = f"{now:%Y-%m}", month_calls
+            remaining = self._remaining_quota()
+            today = date.today()
+            days_in_month = ((today.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)).day
+            month_fraction = (today.day - 1 + datetime.now().hour / 24) / days_in_month
+            projected = round(self.month_calls / month_fraction) if month_fraction > 0 else self.month_calls
+            self._refill(time.monotonic())
+            return {
+                "rate_per_sec": self.rate_per_sec,
+                "burst": self.burst,
+                "tokens_available": round(self.tokens, 2),
+                "paused_for_seconds": round(max(0.0, self.paused_until - time.monotonic()), 1),
+                "queue_length": len(self.waiters),
+                "queued_by_priority": {name: sum(1 for w in self.waiters if w[0] == p) for p, name in PRIORITY_NAMES.items()},
+                "calls_last_minute": calls_last_minute,
+                "calls_last_hour": calls_last_hour,
+                "month": self.month,
+                "calls_this_month": self.month_calls,
+                "monthly_quota": self.monthly_quota,
+                "quota_remaining": remaining,
+                "projected_month_usage": projected,
+                "priorities": self.counters
+            }
+
+upstream_scheduler = UpstreamScheduler(
+    rate_per_sec=float(os.environ.get("SERPAPI_RATE_PER_SEC", "1")),
+    burst=int(os.environ.get("SERPAPI_BURST", "5")),
+    monthly_quota=int(os.environ.get("SERPAPI_MONTHLY_QUOTA", "0")) or None,
+    max_queue=int(os.environ.get("SERPAPI_MAX_QUEUE", "50"))
+)
+
+# Seconds to back off after a SerpApi 429, honouring Retry-After when present
+def get_retry_after(response, default=60):
+    try:
+        return int(response.headers.get("Retry-After", default))
+    except (TypeError, ValueError):
+        return default
+
+# Raised instead of calling SerpApi while the circuit breaker is open and nothing is cached
+class CircuitOpenError(UpstreamBusyError):
+    pass
+
+# Circuit breaker for SerpApi: opens after consecutive failures or slow calls, then fails fast
+# until a background probe succeeds
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, slow_call_seconds=5.0, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = "closed" # closed -> open -> half_open -> closed/open
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.last_failure = None
+
+    def allow_request(self):
+        with self.lock:
+            return self.state == "closed"
+
+    def retry_after(self):
+        with self.lock:
+            return max(1, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self, elapsed):
+        if elapsed > self.slow_call_seconds:
+            self.record_failure(f"slow call ({elapsed:.1f}s)")
+            return
+        with self.lock:
+            self.consecutive_failures = 0
+            if self.state != "closed":
+                logging.info("SerpApi circuit breaker closed after successful probe")
+            self.state = "closed"
+
+    def record_failure(self, reason):
+        with self.lock:
+            self.consecutive_failures += 1
+            self.last_failure = reason
+            if self.state == "half_open" or (self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                logging.error(f"SerpApi circuit breaker opened after {self.consecutive_failures} failures (last: {reason})")
+
+    # Once the reset timeout has passed, re-tries one upstream call in the background
+    def probe_if_due(self, probe):
+        with self.lock:
+            if self.state != "open" or time.monotonic() - self.opened_at < self.reset_timeout:
+                return
+            self.state = "half_open"
+        threading.Thread(target=self._run_probe, args=(probe,), daemon=True).start()
+
+    def _run_probe(self, probe):
+        try:
+            probe()
+        except Exception as e:
+            logging.warning(f"SerpApi circuit breaker probe failed: {e}")
+        with self.lock:
+            if self.state == "half_open": # Probe never reached SerpApi, try again later
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "last_failure": self.last_failure
+            }
+
+# A cached search response stored column-wise: the fields every request touches (token, name,
+# prices, rating, coordinates, class) sit in interned strings and typed arrays, everything else
+# is one zlib-compressed JSON blob. to_response() rebuilds an equivalent dict on each read.
+class CompactSearchResult:
+    __slots__ = ("tokens", "names", "rate_per_night", "total_rate", "ratings", "latitudes", "longitudes",
+                 "hotel_classes", "blob")
+
+    @staticmethod
+    def _number(value):
+        return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+    @classmethod
+    def from_response(cls, data):
+        properties = data.get("properties") or []
+        n = len(properties)
+        self = cls()
+        self.tokens = [None] * n
+        self.names = [None] * n
+        self.rate_per_night = np.full(n, np.nan)
+        self.total_rate = np.full(n, np.nan)
+        self.ratings = np.full(n, np.nan)
+        self.latitudes = np.full(n, np.nan)
+        self.longitudes = np.full(n, np.nan)
+        self.hotel_classes = np.zeros(n, dtype=np.int8) # 0 = not stored in a column
+        rest = []
+        for i, prop in enumerate(properties):
+            prop = dict(prop)
+            if isinstance(prop.get("property_token"), str):
+                self.tokens[i] = sys.intern(prop.pop("property_token"))
+            if isinstance(prop.get("name"), str):
+                self.names[i] = sys.intern(prop.pop("name"))
+            for field, column in (("rate_per_night", self.rate_per_night), ("total_rate", self.total_rate)):
+                if isinstance(prop.get(field), dict) and self._number(prop[field].get("extracted_lowest")) is not None:
+                    prop[field] = dict(prop[field])
+                    column[i] = prop[field].pop("extracted_lowest")
+            if self._number(prop.get("overall_rating")) is not None:
+                self.ratings[i] = prop.pop("overall_rating")
+            gps = prop.get("gps_coordinates")
+            if isinstance(gps, dict) and set(gps) == {"latitude", "longitude"} and \
+                    self._number(gps["latitude"]) is not None and self._number(gps["longitude"]) is not None:
+                self.latitudes[i] = gps["latitude"]
+                self.longitudes[i] = gps["longitude"]
+                del prop["gps_coordinates"]
+            hotel_class = prop.get("extracted_hotel_class")
+            if isinstance(hotel_class, int) and not isinstance(hotel_class, bool) and 0 < hotel_class < 128:
+                self.hotel_classes[i] = prop.pop("extracted_hotel_class")
+            rest.append(prop)
+        envelope = {k: v for k, v in data.items() if k != "properties"}
+        self.blob = zlib.compress(json.dumps({"envelope": envelope, "rest": rest}, separators=(",", ":")).encode())
+        return self
+
+    @staticmethod
+    def _price(value):
+        return int(value) if value.is_integer() else value
+
+    def to_response(self):
+        unpacked = json.loads(zlib.decompress(self.blob))
+        rate_per_night = self.rate_per_night.tolist()
+        total_rate = self.total_rate.tolist()
+        ratings = self.ratings.tolist()
+        latitudes = self.latitudes.tolist()
+        longitudes = self.longitudes.tolist()
+        hotel_classes = self.hotel_classes.tolist()
+        properties = []
+        for i, prop in enumerate(unpacked["rest"]):
+            if self.tokens[i] is not None:
+                prop["property_token"] = self.tokens[i]
+            if self.names[i] is not None:
+                prop["name"] = self.names[i]
+            if rate_per_night[i] == rate_per_night[i]: # not NaN
+                prop["rate_per_night"]["extracted_lowest"] = self._price(rate_per_night[i])
+            if total_rate[i] == total_rate[i]:
+                prop["total_rate"]["extracted_lowest"] = self._price(total_rate[i])
+            if ratings[i] == ratings[i]:
+                prop["overall_rating"] = ratings[i]
+            if latitudes[i] == latitudes[i]:
+                prop["gps_coordinates"] = {"latitude": latitudes[i], "longitude": longitudes[i]}
+            if hotel_classes[i]:
+                prop["extracted_hotel_class"] = hotel_classes[i]
+            properties.append(prop)
+        return dict(unpacked["envelope"], properties=properties)
+
+    def nbytes(self):
+        arrays = (self.rate_per_night, self.total_rate, self.ratings, self.latitudes, self.longitudes, self.hotel_classes)
+        return sys.getsizeof(self.blob) + sum(a.nbytes for a in arrays) + sys.getsizeof(self.tokens) + sys.getsizeof(self.names)
+
+# Most recent upstream responses, keyed by request parameters (LRU).
+# Search responses are kept as CompactSearchResult and expanded again on get().
+class ResponseCache:
+    def __init__(self, max_entries=500):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(kind, params):
+        return kind + ":" + json.dumps(params, sort_keys=True, default=str)
+
+    def put(self, key, data):
+        if isinstance(data, dict) and isinstance(data.get("properties"), list):
+            data = CompactSearchResult.from_response(data)
+        with self.lock:
+            self.entries[key] = (data, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # Returns (data, stored_at) or None when missing or older than max_age seconds
+    def get(self, key, max_age=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if max_age is not None and time.time() - entry[1] > max_age:
+                return None
+            self.entries.move_to_end(key)
+        if isinstance(entry[0], CompactSearchResult):
+            return entry[0].to_response(), entry[1]
+        return entry
+
+serpapi_breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get("SERPAPI_BREAKER_FAILURES", "5")),
+    slow_call_seconds=float(os.environ.get("SERPAPI_SLOW_CALL_SECONDS", "5")),
+    reset_timeout=float(os.environ.get("SERPAPI_BREAKER_RESET_SECONDS", "30"))
+)
+response_cache = ResponseCache(max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "500")))
+STALE_MAX_AGE = int(os.environ.get("SERPAPI_STALE_MAX_AGE", str(24 * 3600))) # Oldest response we will still serve as stale
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "600")) # Responses younger than this are served without calling SerpApi
+
+# Search filters that can be re-applied locally to a cached broader result
+LOCAL_FILTERS = ("min_price", "max_price", "rating", "hotel_class")
+RATING_CODES = {7: 3.5, 8: 4.0, 9: 4.5} # SerpApi rating filter -> minimum overall_rating
+
+def _parse_local_filters(params):
+    rating = params.get("rating")
+    hotel_class = params.get("hotel_class")
+    return {
+        "min_price": params.get("min_price"),
+        "max_price": params.get("max_price"),
+        "rating": RATING_CODES[int(rating)] if rating else None,
+        "hotel_class": {int(c) for c in str(hotel_class).split(",") if c.strip()} if hotel_class else None
+    }
+
+# True when every result matching `wanted` is guaranteed to be among the results for `have`
+def _filters_contain(have, wanted):
+    if have["min_price"] is not None and (wanted["min_price"] is None or wanted["min_price"] < have["min_price"]):
+        return False
+    if have["max_price"] is not None and (wanted["max_price"] is None or wanted["max_price"] > have["max_price"]):
+        return False
+    if have["rating"] is not None and (wanted["rating"] is None or wanted["rating"] < have["rating"]):
+        return False
+    if have["hotel_class"] is not None and (wanted["hotel_class"] is None or not wanted["hotel_class"] <= have["hotel_class"]):
+        return False
+    return True
+
+# Applies the filters to cached properties, or returns None when a property lacks a field the
+# filter needs (its membership cannot be decided locally)
+def _apply_local_filters(properties, wanted):
+    result = []
+    for prop in properties:
+        if wanted["min_price"] is not None or wanted["max_price"] is not None:
+            price = get_nested(prop, ['rate_per_night', 'extracted_lowest'])
+            if price is None:
+                return None
+            if wanted["min_price"] is not None and price < wanted["min_price"]:
+                continue
+            if wanted["max_price"] is not None and price > wanted["max_price"]:
+                continue
+        if wanted["rating"] is not None:
+            if prop.get("overall_rating") is None:
+                return None
+            if prop["overall_rating"] < wanted["rating"]:
+                continue
+        if wanted["hotel_class"] is not None:
+            if prop.get("extracted_hotel_class") is None:
+                return None
+            if prop["extracted_hotel_class"] not in wanted["hotel_class"]:
+                continue
+        result.append(prop)
+    return result
+
+# Remembers which cached searches differ only in LOCAL_FILTERS, so a narrower search can be
+# answered by filtering a broader cached result instead of calling SerpApi
+class SearchContainmentIndex:
+    def __init__(self, max_queries=500, max_per_query=8):
+        self.max_queries = max_queries
+        self.max_per_query = max_per_query
+        self.entries = OrderedDict() # key without local filters -> OrderedDict(cache key -> params)
+        self.lock = threading.Lock()
+        self.derived = 0
+
+    @staticmethod
+    def _base_key(params):
+        return ResponseCache.make_key("search", {k: v for k, v in params.items() if k not in LOCAL_FILTERS})
+
+    def add(self, params, cache_key):
+        if params.get("next_page_token"):
+            return
+        base_key = self._base_key(params)
+        with self.lock:
+            variants = self.entries.setdefault(base_key, OrderedDict())
+            variants[cache_key] = params
+            variants.move_to_end(cache_key)
+            self.entries.move_to_end(base_key)
+            while len(variants) > self.max_per_query:
+                variants.popitem(last=False)
+            while len(self.entries) > self.max_queries:
+                self.entries.popitem(last=False)
+
+    # Returns a response derived from a fresh, complete cached broader search, or None
+    def derive(self, params):
+        if params.get("next_page_token"):
+            return None
+        try:
+            wanted = _parse_local_filters(params)
+        except (KeyError, ValueError):
+            return None
+        with self.lock:
+            candidates = list(self.entries.get(self._base_key(params), {}).items())
+        for cache_key, cached_params in reversed(candidates):
+            try:
+                if not _filters_contain(_parse_local_filters(cached_params), wanted):
+                    continue
+            except (KeyError, ValueError):
+                continue
+            cached = response_cache.get(cache_key, max_age=RESPONSE_CACHE_TTL)
+            # A result with more pages may be missing matches that only appear later
+            if not cached or get_nested(cached[0], ['serpapi_pagination', 'next_page_token']):
+                continue
+            properties = _apply_local_filters(cached[0].get("properties", []), wanted)
+            if properties is None:
+                continue
+            self.derived += 1
+            logging.debug(f"Answered search locally from {cache_key}")
+            return dict(cached[0], properties=properties, derived_from_cache=True)
+        return None
+
+search_containment = SearchContainmentIndex()
+
+# Feature layout for similar-hotel vectors: hashed amenities, then price, rating and location.
+# Each block is scaled to a fixed weight so one block cannot swamp the others, and every row is
+# unit length, so cosine similarity against a whole destination is one matrix-vector product.
+AMENITY_DIMS = 64
+SIMILAR_WEIGHTS = {"amenities": 1.0, "price": 1.0, "rating": 0.5, "location": 0.7}
+SIMILAR_LOCATION_SCALE = 0.05 # Degrees (~5 km) at which location starts to count as different
+SIMILAR_FEATURES = AMENITY_DIMS + 2 + 2 + 3
+
+def _angle_block(fraction):
+    # Maps a value in [0, 1] to a unit 2-vector; the dot product of two is cos of their difference
+    angle = min(max(fraction, 0.0), 1.0) * np.pi / 2
+    return np.cos(angle), np.sin(angle)
+
+class SimilarHotelIndex:
+    def __init__(self, max_per_destination=5000, max_destinations=200):
+        self.max_per_destination = max_per_destination
+        self.max_destinations = max_destinations
+        self.destinations = OrderedDict() # destination -> dict with matrix, rows, tokens, anchor
+        self.token_destination = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _destination_key(destination):
+        return " ".join(str(destination).lower().split())
+
+    def _encode(self, prop, anchor):
+        vector = np.zeros(SIMILAR_FEATURES)
+        amenities = prop.get("amenities") or []
+        if amenities:
+            for amenity in amenities:
+                vector[zlib.crc32(str(amenity).lower().encode()) % AMENITY_DIMS] = 1.0
+            block = vector[:AMENITY_DIMS]
+            block *= SIMILAR_WEIGHTS["amenities"] / np.linalg.norm(block)
+        offset = AMENITY_DIMS
+        price = get_nested(prop, ['rate_per_night', 'extracted_lowest'])
+        if price:
+            # Log scale between 500 and 100,000 (base currency) per night
+            vector[offset:offset + 2] = np.multiply(_angle_block((np.log(price) - np.log(500)) / (np.log(100000) - np.log(500))),
+                                                    SIMILAR_WEIGHTS["price"])
+        offset += 2
+        if prop.get("overall_rating"):
+            vector[offset:offset + 2] = np.multiply(_angle_block((prop["overall_rating"] - 1) / 4), SIMILAR_WEIGHTS["rating"])
+        offset += 2
+        gps = prop.get("gps_coordinates") or {}
+        if gps.get("latitude") is not None and gps.get("longitude") is not None:
+            block = np.array([1.0, (gps["latitude"] - anchor[0]) / SIMILAR_LOCATION_SCALE,
+                              (gps["longitude"] - anchor[1]) / SIMILAR_LOCATION_SCALE])
+            vector[offset:offset + 3] = block * SIMILAR_WEIGHTS["location"] / np.linalg.norm(block)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    @staticmethod
+    def _summary(prop):
+        images = prop.get("images") or []
+        return {
+            "property_token": prop.get("property_token"),
+            "name": prop.get("name"),
+            "rate_per_night": get_nested(prop, ['rate_per_night', 'extracted_lowest']),
+            "overall_rating": prop.get("overall_rating"),
+            "hotel_class": prop.get("extracted_hotel_class"),
+            "thumbnail": images[0].get("thumbnail") if images else None
+        }
+
+    # Adds or refreshes the properties of one search response for its destination
+    def add(self, destination, properties):
+        key = self._destination_key(destination)
+        with self.lock:
+            entry = self.destinations.get(key)
+            if entry is None:
+                entry = {"name": key, "matrix": np.zeros((64, SIMILAR_FEATURES)), "count": 0, "next": 0, "rows": {},
+                         "summaries": [], "anchor": None}
+                self.destinations[key] = entry
+                while len(self.destinations) > self.max_destinations:
+                    _, evicted = self.destinations.popitem(last=False)
+                    for token in evicted["rows"]:
+                        if self.token_destination.get(token) is evicted:
+                            del self.token_destination[token]
+            self.destinations.move_to_end(key)
+            for prop in properties:
+                token = prop.get("property_token")
+                if not token:
+                    continue
+                gps = prop.get("gps_coordinates") or {}
+                if entry["anchor"] is None and gps.get("latitude") is not None and gps.get("longitude") is not None:
+                    entry["anchor"] = (gps["latitude"], gps["longitude"])
+                vector = self._encode(prop, entry["anchor"] or (0.0, 0.0))
+                if vector is None:
+                    continue
+                row = entry["rows"].get(token)
+                if row is None:
+                    row = self._allocate_row(entry)
+                    entry["rows"][token] = row
+                entry["matrix"][row] = vector
+                entry["summaries"][row] = self._summary(prop)
+                self.token_destination[token] = entry
+
+    def _allocate_row(self, entry):
+        if entry["count"] < self.max_per_destination:
+            row = entry["count"]
+            entry["count"] += 1
+            if row >= len(entry["matrix"]):
+                grown = np.zeros((min(len(entry["matrix"]) * 2, self.max_per_destination), SIMILAR_FEATURES))
+                grown[:row] = entry["matrix"][:row]
+                entry["matrix"] = grown
+            entry["summaries"].append(None)
+            return row
+        # Full: overwrite rows in insertion order
+        row = entry["next"]
+        entry["next"] = (row + 1) % self.max_per_destination
+        old_token = entry["summaries"][row]["property_token"]
+        del entry["rows"][old_token]
+        # The token may since have been indexed under another destination; only forget it here
+        if self.token_destination.get(old_token) is entry:
+            del self.token_destination[old_token]
+        return row
+
+    # Returns (destination, [(summary, similarity), ...]) or None when the token is not indexed
+    def similar(self, token, k=5):
+        with self.lock:
+            entry = self.token_destination.get(token)
+            if entry is None:
+                return None
+            destination = entry["name"]
+            row = entry["rows"][token]
+            matrix = entry["matrix"][:entry["count"]]
+            scores = matrix @ matrix[row]
+            summaries = list(entry["summaries"])
+        scores[row] = -np.inf
+        k = min(k, len(scores) - 1)
+        if k <= 0:
+            return destination, []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return destination, [(summaries[i], float(scores[i])) for i in top]
+
+similar_hotels = SimilarHotelIndex(max_per_destination=int(os.environ.get("SIMILAR_MAX_PER_DESTINATION", "5000")))
+
+# SerpApi is always queried in this currency; other currencies are converted locally
+BASE_CURRENCY = "INR"
+PRICE_CONTAINERS = ("rate_per_night", "total_rate")
+
+# Exchange rates from a JSON file ({"rates": {code: units per 1 base}, "symbols": {...}}),
+# re-read in the background whenever the file changes
+class FxRateTable:
+    def __init__(self, path, refresh_interval=3600):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.rates = {BASE_CURRENCY: 1.0}
+        self.symbols = {}
+        self.updated = None
+        self.mtime = None
+        self.lock = threading.Lock()
+        self.reload()
+        threading.Thread(target=self._refresh_loop, name="fx-refresh", daemon=True).start()
+
+    def reload(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self.mtime:
+                return
+            with open(self.path) as f:
+                table = json.load(f)
+            if table.get("base", BASE_CURRENCY) != BASE_CURRENCY:
+                raise ValueError(f"FX table base is {table['base']}, expected {BASE_CURRENCY}")
+            rates = {code.upper(): float(rate) for code, rate in table["rates"].items() if float(rate) > 0}
+            rates[BASE_CURRENCY] = 1.0
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.error(f"Could not load FX rates from {self.path}: {e}")
+            return
+        with self.lock:
+            self.rates = rates
+            self.symbols = table.get("symbols", {})
+            self.updated = table.get("updated")
+            self.mtime = mtime
+        logging.info(f"Loaded {len(rates)} FX rates from {self.path}")
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            self.reload()
+
+    # Returns (rate, symbol) for a currency code, or None when the currency is unknown
+    def lookup(self, currency):
+        with self.lock:
+            rate = self.rates.get(currency)
+            if rate is None:
+                return None
+            return rate, self.symbols.get(currency, currency + " ")
+
+    def currencies(self):
+        with self.lock:
+            return sorted(self.rates)
+
+def _collect_prices(node, found):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in PRICE_CONTAINERS and isinstance(value, dict):
+                for field, amount in value.items():
+                    if field.startswith("extracted_") and isinstance(amount, (int, float)) and not isinstance(amount, bool):
+                        found.append((value, field, amount))
+            else:
+                _collect_prices(value, found)
+    elif isinstance(node, list):
+        for item in node:
+            _collect_prices(item, found)
+
+# Returns a copy of a SerpApi response with every rate_per_night/total_rate price converted from
+# the base currency. All amounts are gathered first and converted in a single array operation.
+def convert_prices(data, currency):
+    if currency == BASE_CURRENCY:
+        return data
+    rate, symbol = fx_rates.lookup(currency)
+    data = copy.deepcopy(data)
+    found = []
+    _collect_prices(data, found)
+    if not found:
+        return data
+    converted = np.round(np.fromiter((amount for _, _, amount in found), dtype=np.float64, count=len(found)) * rate, 2)
+    for (container, field, _), amount in zip(found, converted.tolist()):
+        container[field] = amount
+        display_field = field[len("extracted_"):]
+        if display_field in container:
+            container[display_field] = f"{symbol}{amount:,.0f}"
+    return data
+
+fx_rates = FxRateTable(os.environ.get("FX_RATES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fx_rates.json")),
+                       refresh_interval=int(os.environ.get("FX_REFRESH_SECONDS", "3600")))
+
+# Canonical destination names for autocomplete and stable search cache keys. Seeded from a bundled
+# city list and extended with destinations that past searches found hotels for. Prefix lookups bisect
+# into a sorted list of (key, canonical) pairs, with a key for every word start of each name and alias.
+class DestinationIndex:
+    def __init__(self, path, max_learned=5000, min_searches=3):
+        self.path = path
+        self.max_learned = max_learned
+        self.min_searches = min_searches
+        self.keys = []
+        self.forms = {}
+        self.labels = {}
+        self.popularity = {}
+        self.pending = OrderedDict() # normalized key -> successful searches, until min_searches is reached
+        self.learned = 0
+        self.lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def normalize(text):
+        text = unicodedata.normalize("NFKD", text or "")
+        return " ".join(re.findall(r"\w+", "".join(c for c in text if not unicodedata.combining(c)).lower()))
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)["destinations"]
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"Could not load destinations from {self.path}: {e}")
+            return
+        keys = set()
+        for entry in entries:
+            name, region, country = entry["name"], entry.get("region"), entry.get("country")
+            names = [name] + entry.get("aliases", [])
+            qualified = [" ".join(filter(None, parts)) for parts in
+                         ((name, region), (name, country), (name, region, country))]
+            self._add(name, ", ".join(dict.fromkeys(filter(None, (name, region, country)))), names + qualified, keys)
+        self.keys = sorted(keys)
+        logging.info(f"Loaded {len(entries)} destinations from {self.path}")
+
+    # Caller holds the lock (or is still constructing); keys is a set to fill, or None to insort into self.keys
+    def _add(self, canonical, label, forms, keys=None):
+        self.labels.setdefault(canonical, label)
+        for form in forms:
+            self.forms.setdefault(self.normalize(form), canonical)
+        for form in forms[:1] if keys is None else forms:
+            words = self.normalize(form).split()
+            for i in range(len(words)):
+                if keys is None:
+                    bisect.insort(self.keys, (" ".join(words[i:]), canonical))
+                else:
+                    keys.add((" ".join(words[i:]), canonical))
+
+    # Known spellings ("faridabad ", "Faridabad, Haryana") map to one name; anything else is only trimmed
+    def canonicalize(self, text):
+        cleaned = " ".join((text or "").split())
+        with self.lock:
+            return self.forms.get(self.normalize(cleaned), cleaned)
+
+    # Records a destination that a search found hotels for. An unknown one is only offered to every
+    # user once min_searches searches have found hotels for it, so one-off queries and typos stay out.
+    def learn(self, text, count=1):
+        canonical = self.canonicalize(text)
+        key = self.normalize(canonical)
+        if not key:
+            return canonical
+        with self.lock:
+            if key not in self.forms:
+                searches = self.pending.pop(key, 0) + count
+                if searches < self.min_searches or self.learned >= self.max_learned:
+                    self.pending[key] = searches
+                    while len(self.pending) > self.max_learned:
+                        self.pending.popitem(last=False)
+                    return canonical
+                # Stored in title case when typed all lower case, so "new town" is shown as "New Town"
+                canonical = canonical.title() if canonical.islower() else canonical
+                self.learned += 1
+                self._add(canonical, canonical, [canonical])
+                count = searches
+            self.popularity[canonical] = self.popularity.get(canonical, 0) + count
+        return canonical
+
+    def suggest(self, prefix, limit=8):
+        key = self.normalize(prefix)
+        if not key:
+            return []
+        matches = set()
+        with self.lock:
+            start = bisect.bisect_left(self.keys, (key,))
+            for i in range(start, min(start + DESTINATION_SCAN_LIMIT, len(self.keys))):
+                if not self.keys[i][0].startswith(key):
+                    break
+                matches.add(self.keys[i][1])
+            # Most searched first, then names that start with the prefix before mid-name matches
+            ranked = sorted(matches, key=lambda c: (-self.popularity.get(c, 0), not self.normalize(c).startswith(key), c))
+            return [{"destination": c, "label": self.labels[c], "searches": self.popularity.get(c, 0)}
+                    for c in ranked[:limit]]
+
+    def get_stats(self):
+        with self.lock:
+            return {"destinations": len(self.labels), "learned": self.learned, "pending": len(self.pending),
+                    "keys": len(self.keys)}
+
+DESTINATION_SCAN_LIMIT = 500
+
+destination_index = DestinationIndex(os.environ.get("DESTINATIONS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "destinations.json")),
+                                     max_learned=int(os.environ.get("DESTINATIONS_MAX_LEARNED", "5000")),
+                                     min_searches=int(os.environ.get("DESTINATIONS_MIN_SEARCHES", "3")))
+
+# Collects prices seen in SerpApi responses and writes them to price_observations in batches
+# from a background thread, so the request path only pays for a queue put
+class PriceObservationWriter:
+    def __init__(self, batch_size=500, flush_interval=2.0, max_queue=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self.thread = threading.Thread(target=self._run, name="price-writer", daemon=True)
+        self.thread.start()
+
+    # kind is "search" or "detail"; params are the SerpApi parameters the response answers
+    def submit(self, kind, params, data):
+        observed_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            self.queue.put_nowait((kind, params, data, observed_at))
+        except queue.Full:
+            self.dropped += 1
+
+    def _rows_for(self, kind, params, data, observed_at):
+        stay_date = params.get("check_in_date")
+        if not stay_date:
+            return []
+        if kind == "search":
+            properties = data.get("properties", [])
+        else:
+            prop = data.get("place_results") or data.get("property_data") or data
+            properties = [dict(prop, property_token=prop.get("property_token") or params.get("property_token"))]
+        rows = []
+        for prop in properties:
+            hotel_id = prop.get("property_token")
+            total_price = get_nested(prop, ['total_rate', 'extracted_lowest'])
+            rate_per_night = get_nested(prop, ['rate_per_night', 'extracted_lowest'])
+            if not hotel_id or (total_price is None and rate_per_night is None):
+                continue
+            rows.append((hotel_id, prop.get("name"), params.get("q"), stay_date, params.get("check_out_date"),
+                         observed_at, total_price, rate_per_night, params.get("currency"), kind))
+        return rows
+
+    # Hotel positions from the same response, for the hotel_locations spatial index
+    def _locations_for(self, kind, params, data, observed_at):
+        if kind == "search":
+            properties = data.get("properties", [])
+        elif kind == "detail":
+            prop = data.get("place_results") or data.get("property_data") or data
+            properties = [dict(prop, property_token=prop.get("property_token") or params.get("property_token"))]
+        else:
+            return []
+        rows = []
+        for prop in properties:
+            latitude = get_nested(prop, ['gps_coordinates', 'latitude'])
+            longitude = get_nested(prop, ['gps_coordinates', 'longitude'])
+            if not prop.get("property_token") or latitude is None or longitude is None:
+                continue
+            images = prop.get("images") or []
+            rows.append((prop["property_token"], prop.get("name"), params.get("q"), latitude, longitude,
+                         get_nested(prop, ['rate_per_night', 'extracted_lowest']), prop.get("overall_rating"),
+                         prop.get("extracted_hotel_class"), images[0].get("thumbnail") if images else None, observed_at))
+        return rows
+
+    # Name, description, address and amenities from the same response, for the hotel_text_index search
+    def _documents_for(self, kind, params, data, observed_at):
+        if kind == "search":
+            properties = data.get("properties", [])
+        elif kind == "detail":
+            prop = data.get("place_results") or data.get("property_data") or data
+            properties = [dict(prop, property_token=prop.get("property_token") or params.get("property_token"))]
+        else:
+            return []
+        rows = []
+        for prop in properties:
+            if not prop.get("property_token") or not prop.get("name"):
+                continue
+            amenities = [a if isinstance(a, str) else a.get("name", "") for a in prop.get("amenities") or []]
+            images = prop.get("images") or []
+            rows.append((prop["property_token"], prop["name"], prop.get("description"),
+                         prop.get("address") or prop.get("formatted_address") or prop.get("localized_address"),
+                         ", ".join(a for a in amenities if a) or None, params.get("q"),
+                         get_nested(prop, ['rate_per_night', 'extracted_lowest']), prop.get("overall_rating"),
+                         prop.get("extracted_hotel_class"), images[0].get("thumbnail") if images else None, observed_at))
+        return rows
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            self._write(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write(self, batch):
+        rows = []
+        locations = []
+        documents = []
+        for item in batch:
+            if item is None:
+                continue
+            try:
+                rows.extend(self._rows_for(*item))
+                locations.extend(self._locations_for(*item))
+                documents.extend(self._documents_for(*item))
+            except Exception as e:
+                logging.error(f"Could not extract price observations from {item[0]} response: {e}")
+        if not rows and not locations and not documents:
+            return
+        conn = sqlite3.connect('hotel_booking.db', timeout=30)
+        try:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO price_observations (hotel_id, hotel_name, destination, stay_date, check_out,
+                                                    observed_at, total_price, rate_per_night, currency, source)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                conn.executemany('''
+                    INSERT INTO hotel_locations (hotel_id, name, destination, latitude, longitude, rate_per_night,
+                                                 overall_rating, hotel_class, thumbnail, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(hotel_id) DO UPDATE SET
+                        name = COALESCE(excluded.name, name),
+                        destination = COALESCE(excluded.destination, destination),
+                        latitude = excluded.latitude,
+                        longitude = excluded.longitude,
+                        rate_per_night = COALESCE(excluded.rate_per_night, rate_per_night),
+                        overall_rating = COALESCE(excluded.overall_rating, overall_rating),
+                        hotel_class = COALESCE(excluded.hotel_class, hotel_class),
+                        thumbnail = COALESCE(excluded.thumbnail, thumbnail),
+                        updated_at = excluded.updated_at
+                ''', locations)
+                conn.executemany('''
+                    INSERT OR REPLACE INTO hotel_location_index (id, min_lat, max_lat, min_lng, max_lng)
+                    SELECT id, latitude, latitude, longitude, longitude FROM hotel_locations WHERE hotel_id = ?
+                ''', [(location[0],) for location in locations])
+                conn.executemany('''
+                    INSERT INTO hotel_documents (hotel_id, name, description, address, amenities, destination,
+                                                 rate_per_night, overall_rating, hotel_class, thumbnail, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(hotel_id) DO UPDATE SET
+                        name = excluded.name,
+                        description = COALESCE(excluded.description, description),
+                        address = COALESCE(excluded.address, address),
+                        amenities = COALESCE(excluded.amenities, amenities),
+                        destination = COALESCE(excluded.destination, destination),
+                        rate_per_night = COALESCE(excluded.rate_per_night, rate_per_night),
+                        overall_rating = COALESCE(excluded.overall_rating, overall_rating),
+                        hotel_class = COALESCE(excluded.hotel_class, hotel_class),
+                        thumbnail = COALESCE(excluded.thumbnail, thumbnail),
+                        updated_at = excluded.updated_at
+                ''', documents)
+            self.written += len(rows)
+            logging.debug(f"Stored {len(rows)} price observations, {len(locations)} hotel locations "
+                          f"and {len(documents)} hotel documents")
+        except sqlite3.Error as e:
+            logging.error(f"Database error during price observation insert: {e}")
+        finally:
+            conn.close()
+
+    # Blocks until everything queued so far has been written
+    def flush(self):
+        self.queue.join()
+
+# Remembers responses per Idempotency-Key so client retries replay the original result.
+# Completed responses live in the idempotency_keys table with a hot LRU copy in memory.
+class IdempotencyStore:
+    def __init__(self, ttl_seconds=86400, pending_timeout=60, max_hot_entries=10000):
+        self.ttl_seconds = ttl_seconds
+        self.pending_timeout = pending_timeout # A pending row older than this is an abandoned attempt
+        self.max_hot_entries = max_hot_entries
+        self.hot = OrderedDict() # key -> (request_hash, status_code, body, stored_at)
+        self.lock = threading.Lock()
+        self.prune()
+
+    def prune(self):
+        conn = sqlite3.connect('hotel_booking.db', timeout=30)
+        try:
+            with conn:
+                conn.execute("DELETE FROM idempotency_keys WHERE created_at < datetime('now', ?)", (f'-{self.ttl_seconds} seconds',))
+        except sqlite3.Error as e:
+            logging.error(f"Database error during idempotency key cleanup: {e}")
+        finally:
+            conn.close()
+
+    def _remember(self, key, request_hash, status_code, body):
+        with self.lock:
+            self.hot[key] = (request_hash, status_code, body, time.time())
+            self.hot.move_to_end(key)
+            while len(self.hot) > self.max_hot_entries:
+                self.hot.popitem(last=False)
+
+    # Returns ("proceed", None), ("replay", (status_code, body)), ("mismatch", None) or ("in_progress", None)
+    def begin(self, key, request_hash):
+        with self.lock:
+            hot = self.hot.get(key)
+            if hot and time.time() - hot[3] > self.ttl_seconds:
+                del self.hot[key]
+                hot = None
+        if hot:
+            if hot[0] != request_hash:
+                return "mismatch", None
+            return "replay", (hot[1], hot[2])
+
+        conn = sqlite3.connect('hotel_booking.db', timeout=30)
+        try:
+            with conn:
+                conn.execute('''
+                    DELETE FROM idempotency_keys
+                    WHERE idempotency_key = ? AND (created_at < datetime('now', ?)
+                          OR (status_code IS NULL AND created_at < datetime('now', ?)))
+                ''', (key, f'-{self.ttl_seconds} seconds', f'-{self.pending_timeout} seconds'))
+                try:
+                    conn.execute('INSERT INTO idempotency_keys (idempotency_key, request_hash) VALUES (?, ?)', (key, request_hash))
+                    return "proceed", None
+                except sqlite3.IntegrityError:
+                    row = conn.execute('SELECT request_hash, status_code, response_body FROM idempotency_keys WHERE idempotency_key = ?',
+                                       (key,)).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Database error during idempotency check: {e}")
+            return "proceed", None
+        finally:
+            conn.close()
+
+        if row[0] != request_hash:
+            return "mismatch", None
+        if row[1] is None:
+            return "in_progress", None
+        body = json.loads(row[2])
+        self._remember(key, row[0], row[1], body)
+        return "replay", (row[1], body)
+
+    def complete(self, key, request_hash, status_code, body):
+        conn = sqlite3.connect('hotel_booking.db', timeout=30)
+        try:
+            with conn:
+                conn.execute('UPDATE idempotency_keys SET status_code = ?, response_body = ? WHERE idempotency_key = ?',
+                             (status_code, json.dumps(body), key))
+        except sqlite3.Error as e:
+            logging.error(f"Database error during idempotency key save: {e}")
+        finally:
+            conn.close()
+        self._remember(key, request_hash, status_code, body)
+
+    # Forgets a key whose attempt failed server-side, so the client's retry runs again
+    def release(self, key):
+        conn = sqlite3.connect('hotel_booking.db', timeout=30)
+        try:
+            with conn:
+                conn.execute('DELETE FROM idempotency_keys WHERE idempotency_key = ? AND status_code IS NULL', (key,))
+        except sqlite3.Error as e:
+            logging.error(f"Database error during idempotency key release: {e}")
+        finally:
+            conn.close()
+
+class PaymentDeclinedError(Exception):
+    pass
+
+# Stands in for a payment gateway. Any object with the same charge() and refund() methods can be
+# assigned to payment_processor instead; complete_booking uses whatever is set there.
+class MockPaymentProcessor:
+    DECLINED_CARD = "4000000000000002"
+
+    def __init__(self, delay=2.0):
+        self.delay = delay
+
+    # payment is the card details dict from the booking request (card_number, expiry, cvv, cardholder).
+    # Returns a transaction id or raises PaymentDeclinedError
+    def charge(self, amount, payment):
+        time.sleep(self.delay)
+        if payment.get('card_number') == self.DECLINED_CARD:
+            raise PaymentDeclinedError("Card declined")
+        return random.randint(100000, 999999)
+
+    def refund(self, transaction_id):
+        logging.info(f"Refunded transaction {transaction_id}")
+
+# Runs payment and booking confirmation on worker threads. Job state lives in the booking_jobs
+# table so GET /api/bookings/jobs/<job_id> can be answered by any process.
+# Every heartbeat_interval seconds each process touches the unfinished jobs it holds, so a queued or
+# processing job that has not been touched for stale_after seconds belongs to a process that died.
+class BookingJobQueue:
+    def __init__(self, handler, workers=4, max_queue=100, heartbeat_interval=30, stale_after=120, ttl_seconds=7 * 86400):
+        self.handler = handler # handler(data) -> (response body, status code)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.ttl_seconds = ttl_seconds
+        self.active = set() # ids of this process's jobs that are queued or processing
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._run, name=f"booking-job-{i}", daemon=True) for i in range(workers)]
+        self.threads.append(threading.Thread(target=self._sweep_loop, name="booking-job-sweeper", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def _sweep_loop(self):
+        while True:
+            self._sweep()
+            time.sleep(self.heartbeat_interval)
+
+    # Refreshes this process's unfinished jobs, fails the ones nobody has refreshed and drops expired ones
+    def _sweep(self):
+        with self.lock:
+            active = [(job_id,) for job_id in self.active]
+        conn = sqlite3.connect('hotel_booking.db', timeout=30)
+        try:
+            with conn:
+                conn.executemany("UPDATE booking_jobs SET updated_at = CURRENT_TIMESTAMP WHERE job_id = ? AND status IN ('queued', 'processing')",
+                                 active)
+                conn.execute('''
+                    UPDATE booking_jobs SET status = 'failed', status_code = 500, result = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE status IN ('queued', 'processing') AND updated_at < datetime('now', ?)
+                ''', (json.dumps({"error": "Booking job was interrupted, please try again"}), f'-{self.stale_after} seconds'))
+                conn.execute("DELETE FROM booking_jobs WHERE updated_at < datetime('now', ?)", (f'-{self.ttl_seconds} seconds',))
+        except sqlite3.Error as e:
+            logging.error(f"Database error during booking job sweep: {e}")
+        finally:
+            conn.close()
+
+    def _update(self, job_id, status, status_code=None, result=None):
+        conn = sqlite3.connect('hotel_booking.db', timeout=30)
+        try:
+            with conn:
+                conn.execute('''
+                    UPDATE booking_jobs SET status = ?, status_code = ?, result = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE job_id = ?
+                ''', (status, status_code, json.dumps(result) if result is not None else None, job_id))
         except sqlite3.Error as e:
-            logging.error(f"Database error during booking save: {e}")
-            return None
+            logging.error(f"Database error during booking job update: {e}")
         finally:
             conn.close()
 
-    def get_user_bookings(self, user_id):
-        conn = sqlite3.connect('hotel_booking.db')
+    # Returns the new job id, or None when the queue is full or the job could not be recorded
+    def submit(self, data):
+        job_id = hashlib.sha256(os.urandom(16)).hexdigest()[:32]
+        conn = sqlite3.connect('hotel_booking.db', timeout=30)
         try:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT id, user_id, hotel_name, city, check_in, check_out, room_type, total_price, booking_date, hotel_id
-                FROM bookings
-                WHERE user_id = ? ORDER BY booking_date DESC
-            ''', (user_id,))
-            bookings = cursor.fetchall()
-            result = []
-            for booking in bookings:
-                result.append({
-                    "id": booking[0],
-                    "user_id": booking[1],
-                    "hotel_name": booking[2],
-                    "city": booking[3],
-                    "check_in": booking[4],
-                    "check_out": booking[5],
-                    "room_type": booking[6],
-                    "total_price": booking[7],
-                    "booking_date": booking[8],
-                    "hotel_id": booking[9]
-                })
-            return result
+            with conn:
+                conn.execute("INSERT INTO booking_jobs (job_id, status) VALUES (?, 'queued')", (job_id,))
         except sqlite3.Error as e:
-            logging.error(f"Database error during fetching bookings: {e}")
-            return []
+            logging.error(f"Database error during booking job insert: {e}")
+            return None
         finally:
             conn.close()
+        with self.lock:
+            self.active.add(job_id)
+        try:
+            self.queue.put_nowait((job_id, data))
+        except queue.Full:
+            with self.lock:
+                self.active.discard(job_id)
+            self._update(job_id, 'failed', 503, {"error": "Booking queue is full"})
+            return None
+        return job_id
 
-    def get_user_id(self, username):
-        conn = sqlite3.connect('hotel_booking.db')
+    def get(self, job_id):
+        conn = sqlite3.connect('hotel_booking.db', timeout=30)
         try:
-            cursor = conn.cursor()
-            cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+            row = conn.execute('SELECT job_id, status, status_code, result, created_at, updated_at FROM booking_jobs WHERE job_id = ?',
+                               (job_id,)).fetchone()
         except sqlite3.Error as e:
-            logging.error(f"Database error during fetching user ID: {e}")
+            logging.error(f"Database error during booking job lookup: {e}")
             return None
         finally:
             conn.close()
+        if not row:
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "status_code": row[2],
+            "result": json.loads(row[3]) if row[3] else None,
+            "created_at": row[4],
+            "updated_at": row[5]
+        }
 
-    def ensure_demo_user_exists(self):
-        demo_username = "demouser"
-        demo_password = "password" # Plain text, will be hashed by register_user
-        demo_email = "demo@example.com"
-        demo_full_name = "Demo User"
+    def _run(self):
+        while True:
+            job_id, data = self.queue.get()
+            self._update(job_id, 'processing')
+            try:
+                body, status = self.handler(data)
+            except Exception as e:
+                logging.error(f"Booking job {job_id} crashed: {e}")
+                body, status = {"error": "Failed to create booking"}, 500
+            self._update(job_id, 'succeeded' if status < 400 else 'failed', status, body)
+            with self.lock:
+                self.active.discard(job_id)
+            self.queue.task_done()
 
-        if not self.user_exists(demo_username):
-            logging.info(f"Attempting to create demo user: {demo_username}")
-            if self.register_user(demo_username, demo_password, demo_email, demo_full_name):
-                logging.info(f"Demo user '{demo_username}' created successfully.")
-            else:
-                # This might happen if email is taken but username wasn't, or other db error
-                logging.error(f"Failed to create demo user '{demo_username}' during ensure_demo_user_exists.")
+# Runs follow-up work off the request path. A task that keeps raising is retried with
+# exponential backoff, then written to the dead-letter log as one JSON line.
+class BackgroundTaskRunner:
+    def __init__(self, workers=2, max_queue=1000, max_attempts=3, retry_delay=0.5, dead_letter_path='task_dead_letter.log'):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.dead_letter_path = dead_letter_path
+        self.lock = threading.Lock()
+        self.stats = {"enqueued": 0, "completed": 0, "retried": 0, "dropped": 0, "dead_lettered": 0}
+        self.threads = [threading.Thread(target=self._run, name=f"task-runner-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    # Returns False when the queue is full and the task was dropped
+    def enqueue(self, name, func, *args, **kwargs):
+        try:
+            self.queue.put_nowait((name, func, args, kwargs))
+        except queue.Full:
+            logging.warning(f"Task queue full, dropping {name}")
+            self._count("dropped")
+            return False
+        self._count("enqueued")
+        return True
+
+    def _run(self):
+        while True:
+            name, func, args, kwargs = self.queue.get()
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    func(*args, **kwargs)
+                    self._count("completed")
+                    break
+                except Exception as e:
+                    if attempt == self.max_attempts:
+                        self._dead_letter(name, args, kwargs, e, attempt)
+                    else:
+                        logging.warning(f"Task {name} failed (attempt {attempt}): {e}")
+                        self._count("retried")
+                        time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            self.queue.task_done()
+
+    def _dead_letter(self, name, args, kwargs, error, attempts):
+        logging.error(f"Task {name} failed after {attempts} attempts: {error}")
+        self._count("dead_lettered")
+        entry = {"task": name, "args": args, "kwargs": kwargs, "error": str(error), "attempts": attempts,
+                 "failed_at": datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}
+        try:
+            with self.lock, open(self.dead_letter_path, 'a') as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+        except OSError as e:
+            logging.error(f"Could not write dead-letter entry for {name}: {e}")
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, queued=self.queue.qsize())
+
+    # Blocks until everything queued so far has run or been dead-lettered
+    def flush(self):
+        self.queue.join()
+
+class RateLimitedError(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# Token buckets per (route, client). In memory by default; with persist=True the buckets live
+# in the rate_limit_buckets table so every API process shares the same limits. In-memory buckets
+# are kept in least-recently-used order and the oldest are dropped beyond max_buckets.
+class ClientRateLimiter:
+    def __init__(self, persist=False, max_buckets=100000, prune_interval=60):
+        self.persist = persist
+        self.max_buckets = max_buckets
+        self.prune_interval = prune_interval
+        self.buckets = OrderedDict() # bucket key -> (tokens, updated_at)
+        self.pruned_at = {} # route -> time its persisted buckets were last pruned
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    @staticmethod
+    def _take(tokens, updated_at, now, rate_per_sec, burst):
+        tokens = min(burst, tokens + (now - updated_at) * rate_per_sec)
+        if tokens >= 1:
+            return tokens - 1, 0
+        return tokens, max(1, int((1 - tokens) / rate_per_sec + 0.999))
+
+    # Takes one token or raises RateLimitedError with the seconds until one is available
+    def check(self, route, client, rate_per_sec, burst):
+        key = f"{route}:{client}"
+        now = time.time()
+        if self.persist:
+            retry_after = self._check_persisted(key, now, rate_per_sec, burst)
         else:
-            logging.info(f"Demo user '{demo_username}' already exists.")
+            with self.lock:
+                tokens, updated_at = self.buckets.get(key, (burst, now))
+                tokens, retry_after = self._take(tokens, updated_at, now, rate_per_sec, burst)
+                self.buckets[key] = (tokens, now)
+                self.buckets.move_to_end(key)
+                # Only the least recently seen clients are dropped, a constant amount of work per request
+                while len(self.buckets) > self.max_buckets:
+                    self.buckets.popitem(last=False)
+        if retry_after:
+            with self.lock:
+                self.rejected += 1
+            raise RateLimitedError(f"Too many {route} requests", retry_after)
+
+    def _check_persisted(self, key, now, rate_per_sec, burst):
+        conn = sqlite3.connect('hotel_booking.db', timeout=30, isolation_level=None)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tokens, updated_at FROM rate_limit_buckets WHERE bucket_key = ?', (key,)).fetchone()
+            tokens, retry_after = self._take(*(row or (burst, now)), now, rate_per_sec, burst)
+            conn.execute('INSERT OR REPLACE INTO rate_limit_buckets (bucket_key, tokens, updated_at) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            # A bucket untouched for longer than a full refill is the same as a missing one, so drop those
+            route = key.split(":", 1)[0]
+            with self.lock:
+                prune = now - self.pruned_at.get(route, 0) >= self.prune_interval
+                if prune:
+                    self.pruned_at[route] = now
+            if prune:
+                conn.execute('DELETE FROM rate_limit_buckets WHERE bucket_key > ? AND bucket_key < ? AND updated_at < ?',
+                             (f"{route}:", f"{route};", now - burst / rate_per_sec))
+            conn.execute('COMMIT')
+            return retry_after
+        except sqlite3.Error as e:
+            logging.error(f"Database error during rate limit check: {e}")
+            return 0 # Fail open rather than reject traffic because of the limiter itself
+        finally:
+            conn.close()
+
+class BulkheadFullError(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# Caps how many requests of one class run at once. Up to max_waiting more may wait for a slot,
+# but never longer than max_wait seconds; everything beyond that is rejected immediately.
+class Bulkhead:
+    def __init__(self, name, max_concurrent, max_waiting, max_wait):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.condition = threading.Condition()
+        self.counters = {"admitted": 0, "rejected_full": 0, "rejected_timeout": 0}
+
+    def acquire(self):
+        with self.condition:
+            if self.active < self.max_concurrent and not self.waiting:
+                self.active += 1
+                self.counters["admitted"] += 1
+                return
+            if self.waiting >= self.max_waiting:
+                self.counters["rejected_full"] += 1
+                raise BulkheadFullError(f"{self.name} bulkhead full", retry_after=1)
+            self.waiting += 1
+            try:
+                if not self.condition.wait_for(lambda: self.active < self.max_concurrent, timeout=self.max_wait):
+                    self.counters["rejected_timeout"] += 1
+                    raise BulkheadFullError(f"{self.name} bulkhead wait exceeded {self.max_wait}s", retry_after=1)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.counters["admitted"] += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def get_stats(self):
+        with self.condition:
+            return dict(self.counters, active=self.active, waiting=self.waiting, max_concurrent=self.max_concurrent)
 
 # Google Hotels API Client Class
 class GoogleHotelsAPIClient:
@@ -218,21 +2328,87 @@ class GoogleHotelsAPIClient:
             logging.error("SERPAPI_KEY environment variable is not set")
             raise ValueError("API Key Missing")
 
-    def search_hotels(self, **params):
+    # Sends one request to SerpApi, taking a scheduler slot and feeding the circuit breaker
+    def _fetch(self, params, priority):
+        upstream_scheduler.acquire(priority)
+        started = time.monotonic()
+        try:
+            response = requests.get(self.BASE_URL, params=params, timeout=10)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 429:
+                retry_after = get_retry_after(e.response)
+                upstream_scheduler.penalize(retry_after)
+                raise UpstreamBusyError("SerpApi rate limit reached", retry_after=retry_after)
+            if e.response.status_code >= 500:
+                serpapi_breaker.record_failure(f"HTTP {e.response.status_code}")
+            raise
+        except requests.exceptions.RequestException as e:
+            serpapi_breaker.record_failure(type(e).__name__)
+            raise
+        serpapi_breaker.record_success(time.monotonic() - started)
+        return response
+
+    # Returns the last cached response for cache_key marked as stale, or None
+    def _stale_response(self, cache_key):
+        cached = response_cache.get(cache_key, max_age=STALE_MAX_AGE)
+        if not cached:
+            return None
+        data, stored_at = cached
+        stale_data = dict(data)
+        stale_data["stale"] = True
+        stale_data["cached_at"] = datetime.fromtimestamp(stored_at).isoformat(timespec='seconds')
+        logging.warning(f"Serving stale response for {cache_key} cached at {stale_data['cached_at']}")
+        return stale_data
+
+    # Serves a fresh cached response when there is one, otherwise runs the upstream call behind
+    # the circuit breaker and falls back to the cache when it fails
+    def _call_with_fallback(self, cache_key, upstream_call, priority):
+        if RESPONSE_CACHE_TTL > 0:
+            cached = response_cache.get(cache_key, max_age=RESPONSE_CACHE_TTL)
+            if cached:
+                logging.debug(f"Response cache hit for {cache_key}")
+                return cached[0]
+        if not serpapi_breaker.allow_request():
+            serpapi_breaker.probe_if_due(lambda: self._store_response(cache_key, upstream_call(PRIORITY_PREFETCH)))
+            stale_data = self._stale_response(cache_key)
+            if stale_data is None:
+                raise CircuitOpenError("SerpApi is unavailable, circuit is open", retry_after=serpapi_breaker.retry_after())
+            return stale_data
+        data = self._store_response(cache_key, upstream_call(priority))
+        if data is None:
+            return self._stale_response(cache_key)
+        return data
+
+    def _store_response(self, cache_key, data):
+        if data is not None:
+            response_cache.put(cache_key, data)
+        return data
+
+    def search_hotels(self, priority=PRIORITY_INTERACTIVE, **params):
         default_params = {
             "engine": "google_hotels",
             "api_key": self.api_key,
-            "currency": "INR",
+            "currency": BASE_CURRENCY,
             "gl": "in",  # Localize to India
             "hl": "en"   # Use English
         }
         search_params = {k: v for k, v in params.items() if v is not None}
         default_params.update(search_params)
-        
+        cache_key = response_cache.make_key("search", search_params)
+        if RESPONSE_CACHE_TTL > 0 and not response_cache.get(cache_key, max_age=RESPONSE_CACHE_TTL):
+            derived = search_containment.derive(search_params)
+            if derived is not None:
+                return derived
+        data = self._call_with_fallback(cache_key, lambda p: self._search_upstream(default_params, p), priority)
+        if data is not None and not data.get("stale"):
+            search_containment.add(search_params, cache_key)
+        return data
+
+    def _search_upstream(self, default_params, priority):
         try:
             logging.debug(f"Sending hotel search request with params: {default_params}")
-            response = requests.get(self.BASE_URL, params=default_params, timeout=10)
-            response.raise_for_status()
+            response = self._fetch(default_params, priority)
             data = response.json()
             
             if 'error' in data:
@@ -240,9 +2416,17 @@ class GoogleHotelsAPIClient:
                 logging.error(f"API returned error: {error_message}")
                 return None
                 
-            logging.info(f"Hotel search successful for '{params.get('q')}'")
+            logging.info(f"Hotel search successful for '{default_params.get('q')}'")
             logging.debug(f"API response: {data}")
+            price_writer.submit("search", {k: v for k, v in default_params.items() if k != "api_key"}, data)
+            similar_hotels.add(default_params.get("q", ""), data.get("properties", []))
+            if data.get("properties"):
+                destination = destination_index.learn(default_params.get("q"))
+                if destination:
+                    task_runner.enqueue("destination_search", db_manager.record_destination_search, destination)
             return data
+        except UpstreamBusyError:
+            raise
         except requests.exceptions.HTTPError as e:
             error_message = f"HTTP Error: {str(e)}"
             if e.response.status_code == 400:
@@ -258,7 +2442,7 @@ class GoogleHotelsAPIClient:
             logging.error(error_message)
             return None
 
-    def get_hotel_details(self, property_token: str, check_in_date: str = None, check_out_date: str = None):
+    def get_hotel_details(self, property_token: str, check_in_date: str = None, check_out_date: str = None, priority=PRIORITY_DETAIL):
         # Use the property_token as the 'q' (query) parameter for SerpApi
         # Also include default check_in/check_out dates as they might be required by SerpApi
         # or by Google Hotels backend even for specific property lookups.
@@ -268,7 +2452,7 @@ class GoogleHotelsAPIClient:
             "api_key": self.api_key,
             "property_token": property_token,
             # Optional: currency, gl, hl might still be useful or required by SerpApi
-            "currency": "INR",
+            "currency": BASE_CURRENCY,
             "gl": "in",
             "hl": "en"
         }
@@ -277,10 +2461,14 @@ class GoogleHotelsAPIClient:
         if check_out_date:
             detail_params["check_out_date"] = check_out_date
             
+        cache_key = response_cache.make_key("detail", {"property_token": property_token, "check_in_date": check_in_date, "check_out_date": check_out_date})
+        return self._call_with_fallback(cache_key, lambda p: self._details_upstream(detail_params, p), priority)
+
+    def _details_upstream(self, detail_params, priority):
+        property_token = detail_params["property_token"]
         try:
             logging.debug(f"Sending hotel detail request (using property_token param) with params: {detail_params}")
-            response = requests.get(self.BASE_URL, params=detail_params, timeout=10)
-            response.raise_for_status() # Will raise for 4xx/5xx errors
+            response = self._fetch(detail_params, priority) # Will raise for 4xx/5xx errors
             data = response.json()
 
             if 'error' in data: # Check for error messages within a successful (e.g. 200 OK) JSON response
@@ -294,8 +2482,11 @@ class GoogleHotelsAPIClient:
             # shows the hotel data directly at the root of the response object.
             logging.info(f"Hotel detail lookup successful for property_token '{property_token}'")
             logging.debug(f"API detail response for property_token: {data}")
+            price_writer.submit("detail", {k: v for k, v in detail_params.items() if k != "api_key"}, data)
             return data # The route handler will perform the transformation
             
+        except UpstreamBusyError:
+            raise
         except requests.exceptions.HTTPError as e:
             logging.error(f"HTTP Error during hotel detail lookup for property_token {property_token}: {str(e)}")
             return None
@@ -334,6 +2525,21 @@ def is_expiry_valid(expiry):
 # Initialize managers
 db_manager = DatabaseManager()
 db_manager.ensure_demo_user_exists() # Ensure demo user is created on startup
+# Learned and pending destinations plus the known ones, each with its search count
+for destination, searches in db_manager.get_searched_destinations(2 * destination_index.max_learned + len(destination_index.labels)):
+    destination_index.learn(destination, searches)
+price_writer = PriceObservationWriter(batch_size=int(os.environ.get("PRICE_HISTORY_BATCH_SIZE", "500")))
+atexit.register(price_writer.flush)
+idempotency_store = IdempotencyStore(ttl_seconds=int(os.environ.get("IDEMPOTENCY_KEY_TTL", str(24 * 3600))))
+payment_processor = MockPaymentProcessor(delay=float(os.environ.get("PAYMENT_MOCK_DELAY", "2")))
+# complete_booking is defined with the booking routes below
+booking_jobs = BookingJobQueue(lambda data: complete_booking(data), workers=int(os.environ.get("BOOKING_JOB_WORKERS", "4")))
+task_runner = BackgroundTaskRunner(workers=int(os.environ.get("TASK_RUNNER_WORKERS", "2")),
+                                   dead_letter_path=os.environ.get("TASK_DEAD_LETTER_LOG", "task_dead_letter.log"))
+atexit.register(task_runner.flush)
+# GET /api/bookings/<user_id> responses, keyed by the user's booking_versions row so any write makes them unreachable
+bookings_cache = ResponseCache(max_entries=int(os.environ.get("BOOKINGS_CACHE_MAX_ENTRIES", "1000")))
+BOOKINGS_CACHE_TTL = int(os.environ.get("BOOKINGS_CACHE_TTL", "60"))
 
 try:
     google_hotels_client = GoogleHotelsAPIClient()
@@ -361,10 +2567,169 @@ except Exception as e:
     logging.error(f"Failed to initialize Groq client: {e}")
     # Ensure groq_client remains None if initialization fails
 
-# Mock function to simulate room availability check
+# Worker pool for fanning out several upstream searches from one request
+SEARCH_FANOUT_WORKERS = int(os.environ.get("SEARCH_FANOUT_WORKERS", "8"))
+SEARCH_MANY_MAX_DESTINATIONS = int(os.environ.get("SEARCH_MANY_MAX_DESTINATIONS", "10"))
+SEARCH_MANY_TIMEOUT = float(os.environ.get("SEARCH_MANY_TIMEOUT", "12"))
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_FANOUT_WORKERS, thread_name_prefix="search")
+PRICE_CALENDAR_MAX_WINDOW = int(os.environ.get("PRICE_CALENDAR_MAX_WINDOW", "7"))
+DEAL_MIN_MARKET_SIZE = int(os.environ.get("DEAL_MIN_MARKET_SIZE", "5")) # Fewer comparable rates than this and no deal scores are given
+
+# A hotel is bookable when SerpApi has a rate for it and the local inventory has a free room
 def check_room_availability(hotel):
     extracted_rate = hotel.get('total_rate', {}).get('extracted_lowest', None)
-    return extracted_rate is not None
+    return extracted_rate is not None and hotel.get('available_rooms', 1) > 0
+
+# Copies properties with available_rooms filled in from one batched inventory lookup
+# (the originals may be shared with the response cache)
+def with_availability(properties, check_in, check_out, room_type="Standard Room"):
+    hotel_ids = [prop['property_token'] for prop in properties if prop.get('property_token')]
+    try:
+        available = db_manager.get_available_rooms(hotel_ids, check_in, check_out, room_type) or {}
+    except ValueError: # Unparseable dates, leave availability unknown
+        available = {}
+    result = []
+    for prop in properties:
+        prop = dict(prop)
+        if prop.get('property_token') in available:
+            prop['available_rooms'] = available[prop['property_token']]
+        prop['rooms_available'] = check_room_availability(prop)
+        result.append(prop)
+    return result
+
+# Scores every property's nightly rate against the market for its destination and dates: the
+# other results plus cached history for hotels not in this result set. Returns the properties with
+# a "deal" entry and summary statistics (absolute prices in the base currency).
+def score_deals(properties, history=()):
+    rates = np.array([get_nested(prop, ['rate_per_night', 'extracted_lowest']) for prop in properties], dtype=np.float64)
+    classes = np.array([prop.get('extracted_hotel_class') or 0 for prop in properties], dtype=np.int64)
+    priced = ~np.isnan(rates)
+    market = np.sort(np.concatenate([rates[priced], np.asarray(history, dtype=np.float64)]))
+    if len(market) < DEAL_MIN_MARKET_SIZE:
+        return properties, None
+    
+    mean, std = market.mean(), market.std()
+    percentile = np.searchsorted(market, rates, side='right') / len(market) * 100
+    z_score = (rates - mean) / std if std > 0 else np.zeros_like(rates)
+    
+    # Median of the current results per hotel class (0 = unknown class uses the overall median)
+    class_median = np.full(len(rates), np.median(rates[priced]) if priced.any() else np.nan)
+    class_medians = {}
+    for hotel_class in np.unique(classes[priced & (classes > 0)]):
+        members = classes == hotel_class
+        class_medians[int(hotel_class)] = float(np.median(rates[members & priced]))
+        class_median[members] = class_medians[int(hotel_class)]
+    class_ratio = rates / class_median
+    
+    # 0-100: 60% from how cheap the rate is across the market, 40% from the discount to its class median
+    score = np.clip(0.6 * (100 - percentile) + 0.4 * 50 * (1 + np.clip((1 - class_ratio) * 2, -1, 1)), 0, 100)
+    badge = np.where((z_score <= -1) & (class_ratio <= 0.8), "great_deal",
+                     np.where((percentile <= 25) & (class_ratio < 1), "good_deal", ""))
+    
+    result = []
+    for i, prop in enumerate(properties):
+        prop = dict(prop)
+        if priced[i]:
+            prop['deal'] = {
+                "score": round(float(score[i]), 1),
+                "percentile": round(float(percentile[i]), 1),
+                "z_score": round(float(z_score[i]), 2),
+                "class_median_ratio": round(float(class_ratio[i]), 3),
+                "badge": str(badge[i]) or None
+            }
+        result.append(prop)
+    p25, p50, p75 = np.percentile(market, [25, 50, 75])
+    stats = {
+        "market_size": int(len(market)),
+        "from_history": int(len(market) - priced.sum()),
+        "min": float(market[0]),
+        "p25": round(float(p25), 2),
+        "median": round(float(p50), 2),
+        "p75": round(float(p75), 2),
+        "max": float(market[-1]),
+        "mean": round(float(mean), 2),
+        "std": round(float(std), 2),
+        "class_medians": class_medians
+    }
+    return result, stats
+
+# Upstream calls that could not be scheduled become 503s the client can retry
+@app.errorhandler(UpstreamBusyError)
+def handle_upstream_busy(e):
+    response = jsonify({"error": "Hotel search is busy, please retry shortly", "details": str(e)})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 503
+
+# Per-client limits for routes that spend SerpApi or Groq quota: (requests per minute, burst).
+# Override with RATE_LIMIT_<NAME>=<per minute>,<burst>, e.g. RATE_LIMIT_SEARCH=60,20
+RATE_LIMITS = {
+    "search": (30, 10),
+    "search_many": (6, 2),
+    "price_calendar": (6, 2),
+    "hotel_detail": (30, 10),
+    "chat": (20, 5),
+}
+for name in RATE_LIMITS:
+    override = os.environ.get(f"RATE_LIMIT_{name.upper()}")
+    if override:
+        per_minute, burst = override.split(",")
+        RATE_LIMITS[name] = (float(per_minute), int(burst))
+client_rate_limiter = ClientRateLimiter(persist=os.environ.get("RATE_LIMIT_PERSIST", "").lower() in ("1", "true", "yes"))
+
+# Clients are identified by remote address: the API has no authenticated session, and any
+# header the caller controls could be changed per request to get a fresh bucket
+def rate_limit_client():
+    return f"ip:{request.remote_addr}"
+
+# Rejects the request before the view runs, so no upstream work starts for limited clients
+def rate_limited(name):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            per_minute, burst = RATE_LIMITS[name]
+            client_rate_limiter.check(name, rate_limit_client(), per_minute / 60.0, burst)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@app.errorhandler(RateLimitedError)
+def handle_rate_limited(e):
+    response = jsonify({"error": "Too many requests, please slow down", "details": str(e)})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 429
+
+# Requests that may wait on SerpApi or Groq get their own bulkhead, so a slow upstream can only
+# tie up that many workers and local routes (login, bookings, inventory) keep their own slots
+UPSTREAM_ENDPOINTS = {"search_hotels", "search_many_hotels", "price_calendar", "get_hotel_detail_route",
+                      "get_hotel_detail_from_link_route", "chat"}
+bulkheads = {
+    "upstream": Bulkhead("upstream", max_concurrent=int(os.environ.get("UPSTREAM_MAX_CONCURRENT", "16")),
+                         max_waiting=int(os.environ.get("UPSTREAM_MAX_WAITING", "32")),
+                         max_wait=float(os.environ.get("UPSTREAM_MAX_WAIT", "2"))),
+    "local": Bulkhead("local", max_concurrent=int(os.environ.get("LOCAL_MAX_CONCURRENT", "32")),
+                      max_waiting=int(os.environ.get("LOCAL_MAX_WAITING", "64")),
+                      max_wait=float(os.environ.get("LOCAL_MAX_WAIT", "1"))),
+}
+
+@app.before_request
+def admit_request():
+    if request.endpoint is None or request.method == 'OPTIONS':
+        return
+    bulkhead = bulkheads["upstream" if request.endpoint in UPSTREAM_ENDPOINTS else "local"]
+    bulkhead.acquire()
+    g.bulkhead = bulkhead
+
+@app.teardown_request
+def release_bulkhead(exc=None):
+    bulkhead = g.pop('bulkhead', None)
+    if bulkhead is not None:
+        bulkhead.release()
+
+@app.errorhandler(BulkheadFullError)
+def handle_bulkhead_full(e):
+    response = jsonify({"error": "Server is busy, please retry shortly", "details": str(e)})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 503
 
 # API Routes
 @app.route('/api/register', methods=['POST'])
@@ -414,38 +2779,36 @@ def login():
     else:
         return jsonify({"error": "Invalid username or password"}), 401
 
-@app.route('/api/hotels/search', methods=['GET'])
-def search_hotels():
-    # Extract query parameters
+# Builds SerpApi search parameters from query args (or a JSON body with the same keys)
+def parse_search_params(args):
     params = {
-        'q': request.args.get('destination'),
-        'check_in_date': request.args.get('check_in_date'),
-        'check_out_date': request.args.get('check_out_date'),
-        'adults': request.args.get('adults'),
-        'sort_by': request.args.get('sort_by'),
-        'min_price': request.args.get('min_price'),
-        'max_price': request.args.get('max_price'),
-        'property_types': request.args.get('property_types'),
-        'amenities': request.args.get('amenities'),
-        'rating': request.args.get('rating'),
-        'brands': request.args.get('brands'),
-        'hotel_class': request.args.get('hotel_class'),
-        'eco_certified': request.args.get('eco_certified'),
-        'vacation_rentals': request.args.get('vacation_rentals'),
-        'bedrooms': request.args.get('bedrooms'),
-        'bathrooms': request.args.get('bathrooms'),
-        'free_cancellation': request.args.get('free_cancellation'),
-        'special_offers': request.args.get('special_offers'),
-        'next_page_token': request.args.get('next_page_token')
+        'q': destination_index.canonicalize(args.get('destination')) or None,
+        'check_in_date': args.get('check_in_date'),
+        'check_out_date': args.get('check_out_date'),
+        'adults': args.get('adults'),
+        'sort_by': args.get('sort_by'),
+        'min_price': args.get('min_price'),
+        'max_price': args.get('max_price'),
+        'property_types': args.get('property_types'),
+        'amenities': args.get('amenities'),
+        'rating': args.get('rating'),
+        'brands': args.get('brands'),
+        'hotel_class': args.get('hotel_class'),
+        'eco_certified': args.get('eco_certified'),
+        'vacation_rentals': args.get('vacation_rentals'),
+        'bedrooms': args.get('bedrooms'),
+        'bathrooms': args.get('bathrooms'),
+        'free_cancellation': args.get('free_cancellation'),
+        'special_offers': args.get('special_offers'),
+        'next_page_token': args.get('next_page_token')
     }
     
-    # Validate required parameters
-    if not params['q']:
-        return jsonify({"error": "Destination is required"}), 400
-    if not params['check_in_date']:
-        return jsonify({"error": "Check-in date is required"}), 400
-    if not params['check_out_date']:
-        return jsonify({"error": "Check-out date is required"}), 400
+    # JSON bodies may carry real booleans, SerpApi wants "true"
+    for flag in ['eco_certified', 'vacation_rentals', 'free_cancellation', 'special_offers']:
+        if params[flag] is True:
+            params[flag] = "true"
+        elif params[flag] is False:
+            params[flag] = None
     
     # Convert numeric parameters
     if params['adults']:
@@ -466,21 +2829,258 @@ def search_hotels():
         params['bathrooms'] = int(params['bathrooms'])
     else:
         params['bathrooms'] = None
+    return params
+
+# Validates the optional currency argument; returns the upper-cased code or None if unsupported
+def parse_currency(args):
+    currency = (args.get('currency') or BASE_CURRENCY).strip().upper()
+    if fx_rates.lookup(currency) is None:
+        return None
+    return currency
+
+# Price filters arrive in the display currency but SerpApi is searched in the base currency
+def price_filters_to_base(params, currency):
+    if currency == BASE_CURRENCY:
+        return
+    rate = fx_rates.lookup(currency)[0]
+    if params['min_price']:
+        params['min_price'] = int(params['min_price'] / rate)
+    if params['max_price']:
+        params['max_price'] = int(np.ceil(params['max_price'] / rate))
+
+def unsupported_currency_response():
+    return jsonify({"error": f"Unsupported currency, expected one of: {', '.join(fx_rates.currencies())}"}), 400
+
+@app.route('/api/hotels/search', methods=['GET'])
+@rate_limited("search")
+def search_hotels():
+    # Extract query parameters
+    params = parse_search_params(request.args)
+    
+    # Validate required parameters
+    if not params['q']:
+        return jsonify({"error": "Destination is required"}), 400
+    if not params['check_in_date']:
+        return jsonify({"error": "Check-in date is required"}), 400
+    if not params['check_out_date']:
+        return jsonify({"error": "Check-out date is required"}), 400
+    currency = parse_currency(request.args)
+    if not currency:
+        return unsupported_currency_response()
+    price_filters_to_base(params, currency)
     
     # Search hotels
     results = google_hotels_client.search_hotels(**params)
     if results:
+        results = dict(results)
+        properties = with_availability(results.get('properties', []), params['check_in_date'], params['check_out_date'],
+                                       request.args.get('room_type', 'Standard Room'))
+        history = db_manager.get_destination_rates(params['q'], params['check_in_date'],
+                                                   [prop['property_token'] for prop in properties if prop.get('property_token')])
+        results['properties'], price_stats = score_deals(properties, history)
+        results = convert_prices(results, currency)
+        results['currency'] = currency
+        if price_stats:
+            rate = fx_rates.lookup(currency)[0]
+            for key in ("min", "p25", "median", "p75", "max", "mean", "std"):
+                price_stats[key] = round(price_stats[key] * rate, 2)
+            price_stats["class_medians"] = {c: round(m * rate, 2) for c, m in price_stats["class_medians"].items()}
+        results['price_stats'] = price_stats
         return jsonify(results), 200
     else:
         return jsonify({"error": "Failed to search hotels"}), 500
 
+# Runs one destination of a multi-destination search on the worker pool
+def search_destination(params, currency=BASE_CURRENCY):
+    try:
+        results = google_hotels_client.search_hotels(**params)
+    except UpstreamBusyError as e:
+        return {"status": "busy", "error": str(e), "retry_after": e.retry_after}
+    if not results:
+        return {"status": "error", "error": "Failed to search hotels"}
+    return {
+        "status": "ok",
+        "stale": bool(results.get("stale")),
+        "properties": convert_prices(with_availability(results.get("properties", []), params['check_in_date'], params['check_out_date']), currency),
+        "next_page_token": get_nested(results, ['serpapi_pagination', 'next_page_token'])
+    }
+
+@app.route('/api/hotels/search_many', methods=['POST'])
+@rate_limited("search_many")
+def search_many_hotels():
+    data = request.get_json() or {}
+    
+    destinations = data.get('destinations')
+    if not destinations or not isinstance(destinations, list):
+        return jsonify({"error": "destinations must be a non-empty list"}), 400
+    # Drop blanks and repeats ("Mumbai", "mumbai ", "Bombay") so each city costs one upstream call
+    unique_destinations = []
+    seen = set()
+    for destination in destinations:
+        if not isinstance(destination, str) or not destination.strip():
+            continue
+        destination = destination_index.canonicalize(destination)
+        if destination_index.normalize(destination) not in seen:
+            seen.add(destination_index.normalize(destination))
+            unique_destinations.append(destination)
+    if not unique_destinations:
+        return jsonify({"error": "destinations must be a non-empty list"}), 400
+    if len(unique_destinations) > SEARCH_MANY_MAX_DESTINATIONS:
+        return jsonify({"error": f"At most {SEARCH_MANY_MAX_DESTINATIONS} destinations per request"}), 400
+    
+    currency = parse_currency(data)
+    if not currency:
+        return unsupported_currency_response()
+    shared = {k: v for k, v in data.items() if k not in ('destinations', 'destination', 'next_page_token', 'currency')}
+    try:
+        base_params = parse_search_params(shared)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid numeric filter value"}), 400
+    if not base_params['check_in_date']:
+        return jsonify({"error": "Check-in date is required"}), 400
+    if not base_params['check_out_date']:
+        return jsonify({"error": "Check-out date is required"}), 400
+    price_filters_to_base(base_params, currency)
+    
+    futures = {}
+    for destination in unique_destinations:
+        params = dict(base_params, q=destination)
+        futures[search_executor.submit(search_destination, params, currency)] = destination
+    done, not_done = wait(futures, timeout=SEARCH_MANY_TIMEOUT)
+    for future in not_done:
+        future.cancel() # Ones already running finish in the background and land in the cache
+    
+    results = []
+    for future, destination in futures.items():
+        if future in done:
+            try:
+                outcome = future.result()
+            except Exception as e:
+                logging.error(f"Multi-destination search failed for '{destination}': {e}")
+                outcome = {"status": "error", "error": "Failed to search hotels"}
+        else:
+            outcome = {"status": "timeout", "error": f"No response within {SEARCH_MANY_TIMEOUT}s"}
+        results.append(dict(outcome, destination=destination))
+    
+    succeeded = sum(1 for r in results if r["status"] == "ok")
+    response = {
+        "check_in_date": base_params['check_in_date'],
+        "check_out_date": base_params['check_out_date'],
+        "currency": currency,
+        "partial": succeeded < len(results),
+        "results": results
+    }
+    if not succeeded:
+        response["error"] = "Failed to search hotels"
+        return jsonify(response), 500
+    return jsonify(response), 200
+
+# Runs one date variant of a price calendar and returns (status, prices, stale)
+def search_calendar_variant(params, priority):
+    try:
+        results = google_hotels_client.search_hotels(priority=priority, **params)
+    except UpstreamBusyError:
+        return "busy", [], False
+    if not results:
+        return "error", [], False
+    prices = [get_nested(prop, ['total_rate', 'extracted_lowest']) for prop in results.get("properties", [])]
+    return "ok", [p for p in prices if isinstance(p, (int, float))], bool(results.get("stale"))
+
+@app.route('/api/hotels/price_calendar', methods=['GET'])
+@rate_limited("price_calendar")
+def price_calendar():
+    params = parse_search_params(request.args)
+    if not params['q']:
+        return jsonify({"error": "Destination is required"}), 400
+    if not params['check_in_date']:
+        return jsonify({"error": "Check-in date is required"}), 400
+    try:
+        center = date.fromisoformat(params['check_in_date'])
+        nights = int(request.args.get('nights', 1))
+        window = int(request.args.get('window', 3))
+    except ValueError:
+        return jsonify({"error": "Invalid check_in_date, nights or window"}), 400
+    if not 1 <= nights <= 30:
+        return jsonify({"error": "nights must be between 1 and 30"}), 400
+    if not 0 <= window <= PRICE_CALENDAR_MAX_WINDOW:
+        return jsonify({"error": f"window must be between 0 and {PRICE_CALENDAR_MAX_WINDOW}"}), 400
+    currency = parse_currency(request.args)
+    if not currency:
+        return unsupported_currency_response()
+    price_filters_to_base(params, currency)
+    params['next_page_token'] = None
+    
+    # One search per check-in date in [center - window, center + window], skipping past dates
+    check_ins = [center + timedelta(days=offset) for offset in range(-window, window + 1)]
+    check_ins = [d for d in check_ins if d >= date.today()]
+    if not check_ins:
+        return jsonify({"error": "All dates in the window are in the past"}), 400
+    futures = []
+    for check_in in check_ins:
+        variant = dict(params, check_in_date=check_in.isoformat(), check_out_date=(check_in + timedelta(days=nights)).isoformat())
+        # The requested date is interactive, the neighbours are speculative and shed first
+        priority = PRIORITY_INTERACTIVE if check_in == center else PRIORITY_PREFETCH
+        futures.append(search_executor.submit(search_calendar_variant, variant, priority))
+    done, not_done = wait(futures, timeout=SEARCH_MANY_TIMEOUT)
+    for future in not_done:
+        future.cancel()
+    
+    statuses, stale_flags, price_lists = [], [], []
+    for future in futures:
+        if future in done and future.exception() is None:
+            status, prices, stale = future.result()
+        else:
+            status, prices, stale = ("timeout" if future in not_done else "error"), [], False
+        statuses.append(status)
+        stale_flags.append(stale)
+        price_lists.append(prices)
+    
+    # Lowest price per date in one pass over every collected price
+    counts = np.array([len(prices) for prices in price_lists], dtype=np.int64)
+    all_prices = np.fromiter((p for prices in price_lists for p in prices), dtype=np.float64, count=int(counts.sum()))
+    date_index = np.repeat(np.arange(len(check_ins)), counts)
+    lowest = np.full(len(check_ins), np.inf)
+    np.minimum.at(lowest, date_index, all_prices)
+    lowest[counts == 0] = np.nan
+    lowest *= fx_rates.lookup(currency)[0]
+    per_night = lowest / nights
+    
+    calendar = []
+    for i, check_in in enumerate(check_ins):
+        priced = not np.isnan(lowest[i])
+        calendar.append({
+            "check_in_date": check_in.isoformat(),
+            "check_out_date": (check_in + timedelta(days=nights)).isoformat(),
+            "status": statuses[i],
+            "stale": stale_flags[i],
+            "properties_priced": int(counts[i]),
+            "lowest_total": round(float(lowest[i]), 2) if priced else None,
+            "lowest_per_night": round(float(per_night[i]), 2) if priced else None
+        })
+    cheapest = None
+    if not np.all(np.isnan(lowest)):
+        cheapest = calendar[int(np.nanargmin(lowest))]["check_in_date"]
+    
+    return jsonify({
+        "destination": params['q'],
+        "nights": nights,
+        "window": window,
+        "currency": currency,
+        "cheapest_check_in_date": cheapest,
+        "calendar": calendar
+    }), 200
+
 @app.route('/api/hotel_detail/<property_token>', methods=['GET'])
+@rate_limited("hotel_detail")
 def get_hotel_detail_route(property_token):
     if not property_token:
         return jsonify({"error": "Property token is required"}), 400
 
     check_in_date = request.args.get('check_in_date')
     check_out_date = request.args.get('check_out_date')
+    currency = parse_currency(request.args)
+    if not currency:
+        return unsupported_currency_response()
 
     hotel_detail_data = google_hotels_client.get_hotel_details(property_token, check_in_date, check_out_date)
 
@@ -497,6 +3097,7 @@ def get_hotel_detail_route(property_token):
     # Let's assume hotel_detail_data is the root object containing hotel info.
     
     try:
+        hotel_detail_data = convert_prices(hotel_detail_data, currency)
         # Check if the main data is under a specific key like 'place_results' or 'property_data'
         # For now, assume it's at the root as per some SerpApi examples for direct lookups.
         prop = hotel_detail_data 
@@ -515,11 +3116,15 @@ def get_hotel_detail_route(property_token):
             "rating": prop.get("overall_rating") or prop.get("rating") or 0,
             "images": [img.get("image") or img.get("thumbnail") or img.get("original_image") for img in prop.get("images", []) if img.get("image") or img.get("thumbnail") or img.get("original_image")] or \
                       ([prop.get("thumbnail")] if prop.get("thumbnail") else []), # Fallback for single thumbnail
-            "amenities": prop.get("amenities") or []
+            "amenities": prop.get("amenities") or [],
+            "currency": currency
         }
         # Ensure images has at least one placeholder if empty, to prevent frontend errors
         if not transformed_hotel["images"]:
             transformed_hotel["images"] = ["/placeholder.svg"] # Match frontend fallback
+        if hotel_detail_data.get("stale"): # Served from cache while SerpApi is unavailable
+            transformed_hotel["stale"] = True
+            transformed_hotel["cached_at"] = hotel_detail_data.get("cached_at")
 
         logging.debug(f"Transformed hotel data for token {property_token} being sent to frontend: {transformed_hotel}")
         return jsonify(transformed_hotel), 200
@@ -527,7 +3132,181 @@ def get_hotel_detail_route(property_token):
         logging.error(f"Error transforming hotel detail data for {property_token}: {e}. Raw data: {hotel_detail_data}")
         return jsonify({"error": "Error processing hotel data"}), 500
 
+@app.route('/api/hotel_detail/<property_token>/similar', methods=['GET'])
+def get_similar_hotels_route(property_token):
+    try:
+        k = int(request.args.get('k', 5))
+    except ValueError:
+        return jsonify({"error": "k must be an integer"}), 400
+    if not 1 <= k <= 50:
+        return jsonify({"error": "k must be between 1 and 50"}), 400
+    currency = parse_currency(request.args)
+    if not currency:
+        return unsupported_currency_response()
+    
+    found = similar_hotels.similar(property_token, k)
+    if found is None:
+        return jsonify({"error": "Hotel has not appeared in any recent search"}), 404
+    destination, matches = found
+    rate = fx_rates.lookup(currency)[0]
+    similar = []
+    for summary, similarity in matches:
+        item = dict(summary, similarity=round(similarity, 4))
+        if item["rate_per_night"] is not None:
+            item["rate_per_night"] = round(item["rate_per_night"] * rate, 2)
+        similar.append(item)
+    return jsonify({
+        "property_token": property_token,
+        "destination": destination,
+        "currency": currency,
+        "similar": similar
+    }), 200
+
+KM_PER_DEGREE = 111.32
+NEARBY_MAX_RADIUS_KM = 100
+NEARBY_CANDIDATE_LIMIT = 5000
+
+def haversine_km(lat, lng, lats, lngs):
+    lat1, lng1 = np.radians(lat), np.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371.0088 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+# Radius searches pre-filter with the bounding box around the circle, then keep the exact haversine matches;
+# an explicit north/south/east/west box (a map viewport) is returned as-is, nearest its centre first
+@app.route('/api/hotels/nearby', methods=['GET'])
+def get_nearby_hotels_route():
+    try:
+        limit = int(request.args.get('limit', 50))
+        if 'lat' in request.args or 'lng' in request.args:
+            lat = float(request.args['lat'])
+            lng = float(request.args['lng'])
+            radius_km = float(request.args.get('radius_km', 5))
+            bounds = None
+        else:
+            bounds = tuple(float(request.args[key]) for key in ('south', 'north', 'west', 'east'))
+    except KeyError:
+        return jsonify({"error": "Provide lat and lng, or south, north, west and east bounds"}), 400
+    except ValueError:
+        return jsonify({"error": "Coordinates, radius_km and limit must be numbers"}), 400
+    if not 1 <= limit <= 200:
+        return jsonify({"error": "limit must be between 1 and 200"}), 400
+    currency = parse_currency(request.args)
+    if not currency:
+        return unsupported_currency_response()
+    
+    if bounds is None:
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return jsonify({"error": "lat must be within [-90, 90] and lng within [-180, 180]"}), 400
+        if not 0 < radius_km <= NEARBY_MAX_RADIUS_KM:
+            return jsonify({"error": f"radius_km must be greater than 0 and at most {NEARBY_MAX_RADIUS_KM}"}), 400
+        dlat = radius_km / KM_PER_DEGREE
+        dlng = radius_km / (KM_PER_DEGREE * max(np.cos(np.radians(lat)), 1e-6))
+        south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+        west, east = max(lng - dlng, -180.0), min(lng + dlng, 180.0)
+    else:
+        south, north, west, east = bounds
+        if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+            return jsonify({"error": "Bounds must satisfy -90 <= south <= north <= 90 and -180 <= west <= east <= 180"}), 400
+        lat, lng = (south + north) / 2, (west + east) / 2
+    
+    candidates = db_manager.get_hotels_in_box(south, north, west, east, lat, lng, NEARBY_CANDIDATE_LIMIT)
+    if candidates is None:
+        return jsonify({"error": "Failed to look up nearby hotels"}), 500
+    
+    hotels = []
+    if candidates:
+        distances = haversine_km(lat, lng, np.array([c["latitude"] for c in candidates], dtype=float),
+                                 np.array([c["longitude"] for c in candidates], dtype=float))
+        keep = np.flatnonzero(distances <= radius_km) if bounds is None else np.arange(len(candidates))
+        rate = fx_rates.lookup(currency)[0]
+        for index in keep[np.argsort(distances[keep], kind="stable")][:limit]:
+            hotel = dict(candidates[index], distance_km=round(float(distances[index]), 3))
+            if hotel["rate_per_night"] is not None:
+                hotel["rate_per_night"] = round(hotel["rate_per_night"] * rate, 2)
+            hotels.append(hotel)
+    
+    # More hotels fall in the box than were examined; the nearest are still the ones returned
+    truncated = len(candidates) >= NEARBY_CANDIDATE_LIMIT
+    body = {"center": {"latitude": lat, "longitude": lng}, "currency": currency, "count": len(hotels),
+            "truncated": truncated, "hotels": hotels}
+    if bounds is None:
+        body["radius_km"] = radius_km
+    else:
+        body["bounds"] = {"south": south, "north": north, "west": west, "east": east}
+    return jsonify(body), 200
+
+TEXT_SEARCH_MAX_TERMS = 12
+
+# Free text becomes an OR of quoted terms so punctuation cannot inject FTS5 syntax; BM25 ranks hotels
+# matching more (and rarer) terms first, and the last term is a prefix so partially typed words match
+def build_text_query(text):
+    terms = [f'"{term}"' for term in re.findall(r"\w+", text.lower())[:TEXT_SEARCH_MAX_TERMS]]
+    if not terms:
+        return None
+    terms[-1] += "*"
+    return " OR ".join(terms)
+
+@app.route('/api/hotels/text_search', methods=['GET'])
+def text_search_hotels_route():
+    text = request.args.get('q', '').strip()
+    match = build_text_query(text)
+    if not match:
+        return jsonify({"error": "q must contain at least one word"}), 400
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if not 1 <= limit <= 100:
+        return jsonify({"error": "limit must be between 1 and 100"}), 400
+    currency = parse_currency(request.args)
+    if not currency:
+        return unsupported_currency_response()
+    
+    destination = request.args.get('destination', '').strip() or None
+    hotels = db_manager.search_hotel_text(match, destination, limit)
+    if hotels is None:
+        return jsonify({"error": "Failed to search hotels"}), 500
+    rate = fx_rates.lookup(currency)[0]
+    for hotel in hotels:
+        if hotel["rate_per_night"] is not None:
+            hotel["rate_per_night"] = round(hotel["rate_per_night"] * rate, 2)
+    return jsonify({"query": text, "destination": destination, "currency": currency,
+                    "count": len(hotels), "hotels": hotels}), 200
+
+@app.route('/api/destinations/suggest', methods=['GET'])
+def suggest_destinations_route():
+    prefix = request.args.get('prefix', '')
+    if not destination_index.normalize(prefix):
+        return jsonify({"error": "prefix must contain at least one letter or digit"}), 400
+    try:
+        limit = int(request.args.get('limit', 8))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if not 1 <= limit <= 20:
+        return jsonify({"error": "limit must be between 1 and 20"}), 400
+    return jsonify({"prefix": prefix, "suggestions": destination_index.suggest(prefix, limit)}), 200
+
+@app.route('/api/hotel_detail/<property_token>/price_history', methods=['GET'])
+def get_price_history_route(property_token):
+    stay_from = request.args.get('from')
+    stay_to = request.args.get('to')
+    if request.args.get('stay_date'):
+        stay_from = stay_to = request.args.get('stay_date')
+    try:
+        limit = int(request.args.get('limit', 500))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    if not 1 <= limit <= 5000:
+        return jsonify({"error": "limit must be between 1 and 5000"}), 400
+    
+    history = db_manager.get_price_history(property_token, stay_from, stay_to, limit)
+    if history is None:
+        return jsonify({"error": "Failed to fetch price history"}), 500
+    return jsonify(dict(history, property_token=property_token)), 200
+
 @app.route('/api/hotel_detail_from_link', methods=['GET'])
+@rate_limited("hotel_detail")
 def get_hotel_detail_from_link_route():
     link_url = request.args.get('url')
     if not link_url:
@@ -537,6 +3316,7 @@ def get_hotel_detail_from_link_route():
     if not link_url.startswith("https://serpapi.com/"):
         return jsonify({"error": "Invalid URL domain"}), 400
 
+    upstream_scheduler.acquire(PRIORITY_DETAIL)
     try:
         # Add api_key to the request to the SerpApi link
         # The link itself might have other params, so we add api_key to them
@@ -601,6 +3381,10 @@ def get_hotel_detail_from_link_route():
         return jsonify(transformed_hotel), 200
 
     except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 429:
+            retry_after = get_retry_after(e.response)
+            upstream_scheduler.penalize(retry_after)
+            raise UpstreamBusyError("SerpApi rate limit reached", retry_after=retry_after)
         logging.error(f"HTTP Error during hotel detail lookup from link {link_url}: {str(e)}. Response text: {e.response.text if e.response else 'No response text'}")
         return jsonify({"error": "Failed to fetch hotel details from link (HTTP error)"}), 404 # Or 500
     except Exception as e:
@@ -608,15 +3392,69 @@ def get_hotel_detail_from_link_route():
         return jsonify({"error": "Error processing hotel data from link"}), 500
 
 
-@app.route('/api/bookings', methods=['POST'])
-def create_booking():
-    data = request.get_json()
+# Admin routes need the X-Admin-Key header to match ADMIN_API_KEY; without the setting they are disabled
+def admin_required(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        admin_key = os.environ.get("ADMIN_API_KEY")
+        if not admin_key:
+            return jsonify({"error": "Admin API is disabled"}), 403
+        if not hmac.compare_digest(request.headers.get("X-Admin-Key", ""), admin_key):
+            return jsonify({"error": "Invalid admin key"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/inventory/availability', methods=['GET'])
+def inventory_availability():
+    hotel_ids = [h for h in (request.args.get('hotel_ids') or '').split(',') if h]
+    check_in = request.args.get('check_in')
+    check_out = request.args.get('check_out')
+    if not hotel_ids or not check_in or not check_out:
+        return jsonify({"error": "hotel_ids, check_in and check_out are required"}), 400
+    try:
+        if date.fromisoformat(check_out) <= date.fromisoformat(check_in):
+            return jsonify({"error": "Check-out must be after check-in"}), 400
+    except ValueError:
+        return jsonify({"error": "Dates must be in YYYY-MM-DD format"}), 400
+    
+    available = db_manager.get_available_rooms(hotel_ids, check_in, check_out, request.args.get('room_type', 'Standard Room'))
+    if available is None:
+        return jsonify({"error": "Failed to check availability"}), 500
+    return jsonify({"check_in": check_in, "check_out": check_out, "available_rooms": available}), 200
+
+@app.route('/api/inventory/<hotel_id>', methods=['PUT'])
+@admin_required
+def set_inventory(hotel_id):
+    data = request.get_json() or {}
+    room_type = data.get('room_type', 'Standard Room')
+    try:
+        total_rooms = int(data['total_rooms'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "total_rooms must be a number"}), 400
+    if total_rooms < 0:
+        return jsonify({"error": "total_rooms cannot be negative"}), 400
     
+    if db_manager.set_room_inventory(hotel_id, room_type, total_rooms):
+        return jsonify({"hotel_id": hotel_id, "room_type": room_type, "total_rooms": total_rooms}), 200
+    return jsonify({"error": "Failed to update inventory"}), 500
+
+@app.route('/api/upstream/stats', methods=['GET'])
+def upstream_stats():
+    stats = upstream_scheduler.get_stats()
+    stats["circuit_breaker"] = serpapi_breaker.get_stats()
+    stats["searches_derived_from_cache"] = search_containment.derived
+    stats["background_tasks"] = task_runner.get_stats()
+    stats["bulkheads"] = {name: bulkhead.get_stats() for name, bulkhead in bulkheads.items()}
+    stats["destinations"] = destination_index.get_stats()
+    return jsonify(stats), 200
+
+# Checks a booking request before it is queued; returns (error body, status code) or None
+def validate_booking(data):
     # Validate required fields
     required_fields = ['user_id', 'hotel_name', 'hotel_id', 'city', 'check_in', 'check_out', 'room_type', 'total_price']
     for field in required_fields:
         if field not in data:
-            return jsonify({"error": f"Missing required field: {field}"}), 400
+            return {"error": f"Missing required field: {field}"}, 400
     
     # Process payment (mock)
     payment_data = data.get('payment', {})
@@ -626,39 +3464,523 @@ def create_booking():
     cardholder = payment_data.get('cardholder')
     
     if not all([card_number, expiry, cvv, cardholder]):
-        return jsonify({"error": "All payment details are required"}), 400
+        return {"error": "All payment details are required"}, 400
     
     if len(card_number) != 16 or not is_expiry_valid(expiry) or len(cvv) != 3:
-        return jsonify({"error": "Invalid payment details"}), 400
+        return {"error": "Invalid payment details"}, 400
+    
+    try:
+        rooms = int(data.get('rooms', 1))
+        nights = (date.fromisoformat(data['check_out']) - date.fromisoformat(data['check_in'])).days
+    except (TypeError, ValueError):
+        return {"error": "Invalid dates or number of rooms"}, 400
+    if rooms < 1 or nights < 1:
+        return {"error": "Check-out must be after check-in and at least one room is required"}, 400
+    # Checked here because the card is charged and the booking committed before the follow-up tasks use it
+    try:
+        total_price = float(data['total_price'])
+    except (TypeError, ValueError):
+        return {"error": "total_price must be a number"}, 400
+    if not math.isfinite(total_price) or total_price < 0:
+        return {"error": "total_price must be a finite, non-negative number"}, 400
+    return None
+
+# Queues a validated booking for payment, returning (response body, status code)
+def process_booking(data):
+    error = validate_booking(data)
+    if error:
+        return error
+    job_id = booking_jobs.submit(data)
+    if not job_id:
+        return {"error": "Too many bookings in progress, please retry shortly"}, 503
+    return {
+        "message": "Booking accepted",
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/bookings/jobs/{job_id}"
+    }, 202
+
+# Runs on a booking job worker: charges the card, then stores the booking
+def complete_booking(data):
+    rooms = int(data.get('rooms', 1))
+    total_price = float(data['total_price'])
+    # Cheap pre-check so a sold-out hotel is not charged; save_booking below still decides atomically
+    available = db_manager.get_available_rooms([data['hotel_id']], data['check_in'], data['check_out'], data['room_type'])
+    if available is not None and available.get(data['hotel_id'], 0) < rooms:
+        return {"error": "No rooms available for the selected dates"}, 409
+    try:
+        transaction_id = payment_processor.charge(total_price, data['payment'])
+    except PaymentDeclinedError as e:
+        logging.warning(f"Payment declined: {e}")
+        return {"error": "Payment was declined"}, 402
     
     # Create booking
-    booking_id = db_manager.save_booking(
-        user_id=data['user_id'],
-        hotel_name=data['hotel_name'],
-        hotel_id=data['hotel_id'],
-        city=data['city'],
-        check_in=data['check_in'],
-        check_out=data['check_out'],
-        room_type=data['room_type'],
-        total_price=data['total_price']
-    )
+    try:
+        booking_id = db_manager.save_booking(
+            user_id=data['user_id'],
+            hotel_name=data['hotel_name'],
+            hotel_id=data['hotel_id'],
+            city=data['city'],
+            check_in=data['check_in'],
+            check_out=data['check_out'],
+            room_type=data['room_type'],
+            total_price=total_price,
+            rooms=rooms
+        )
+    except RoomsUnavailableError as e:
+        logging.warning(f"Booking rejected: {e}")
+        payment_processor.refund(transaction_id)
+        return {"error": "No rooms available for the selected dates"}, 409
     
     if booking_id:
-        transaction_id = random.randint(100000, 999999)
-        return jsonify({
+        enqueue_post_booking_tasks(booking_id, transaction_id, data, rooms, total_price)
+        return {
             "message": "Booking successful",
             "booking_id": booking_id,
             "transaction_id": transaction_id
-        }), 201
+        }, 201
+    else:
+        payment_processor.refund(transaction_id)
+        return {"error": "Failed to create booking"}, 500
+
+def record_booking_confirmation(booking_id, user_id, transaction_id):
+    conn = sqlite3.connect('hotel_booking.db', timeout=30)
+    try:
+        with conn:
+            conn.execute('''
+                INSERT OR IGNORE INTO booking_confirmations (booking_id, user_id, transaction_id, confirmation_code)
+                VALUES (?, ?, ?, ?)
+            ''', (booking_id, user_id, transaction_id, f"HB-{booking_id:06d}-{transaction_id}"))
+    finally:
+        conn.close()
+
+def increment_booking_counters(city, rooms, total_price):
+    conn = sqlite3.connect('hotel_booking.db', timeout=30)
+    try:
+        with conn:
+            conn.executemany('''
+                INSERT INTO booking_counters (counter, value) VALUES (?, ?)
+                ON CONFLICT(counter) DO UPDATE SET value = value + excluded.value
+            ''', [("bookings", 1), ("rooms_booked", rooms), ("revenue", total_price), (f"bookings:{city.lower()}", 1)])
+    finally:
+        conn.close()
+
+# Follow-up work for a committed booking; none of it delays the booking result
+def enqueue_post_booking_tasks(booking_id, transaction_id, data, rooms, total_price):
+    task_runner.enqueue("booking_confirmation", record_booking_confirmation, booking_id, data['user_id'], transaction_id)
+    task_runner.enqueue("booking_counters", increment_booking_counters, data['city'], rooms, total_price)
+    # The booked price is a real observation of what the hotel charged for this stay
+    task_runner.enqueue("booking_price_observation", price_writer.submit, "booking",
+                        {"q": data['city'], "check_in_date": data['check_in'], "check_out_date": data['check_out']},
+                        {"property_token": data['hotel_id'], "name": data['hotel_name'],
+                         "total_rate": {"extracted_lowest": total_price / rooms}})
+
+@app.route('/api/bookings', methods=['POST'])
+def create_booking():
+    data = request.get_json()
+    
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if not idempotency_key:
+        body, status = process_booking(data)
+        return booking_response(body, status)
+    if len(idempotency_key) > 255:
+        return jsonify({"error": "Idempotency-Key must be at most 255 characters"}), 400
+    
+    # A retry with the same key gets the stored response without validating or inserting again
+    request_hash = hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    state, stored = idempotency_store.begin(idempotency_key, request_hash)
+    if state == "replay":
+        response, status = booking_response(stored[1], stored[0])
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response, status
+    if state == "mismatch":
+        return jsonify({"error": "Idempotency-Key was already used with a different request"}), 422
+    if state == "in_progress":
+        response = jsonify({"error": "A request with this Idempotency-Key is still being processed"})
+        response.headers['Retry-After'] = '1'
+        return response, 409
+    
+    try:
+        body, status = process_booking(data)
+    except Exception:
+        idempotency_store.release(idempotency_key)
+        raise
+    if status >= 500:
+        idempotency_store.release(idempotency_key)
     else:
-        return jsonify({"error": "Failed to create booking"}), 500
+        idempotency_store.complete(idempotency_key, request_hash, status, body)
+    return booking_response(body, status)
+
+# Adds the headers clients need to follow a queued booking or back off
+def booking_response(body, status):
+    response = jsonify(body)
+    if status == 202:
+        response.headers['Location'] = body['status_url']
+    elif status == 503:
+        response.headers['Retry-After'] = '5'
+    return response, status
+
+@app.route('/api/bookings/jobs/<job_id>', methods=['GET'])
+def get_booking_job(job_id):
+    job = booking_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Booking job not found"}), 404
+    response = jsonify(job)
+    if job['status'] in ('queued', 'processing'):
+        response.headers['Retry-After'] = '1'
+    return response, 200
 
 @app.route('/api/bookings/<int:user_id>', methods=['GET'])
 def get_bookings(user_id):
+    # The version is read before the bookings, so a cached list is never older than its key
+    version = db_manager.get_user_bookings_version(user_id)
+    if version is None:
+        return jsonify(db_manager.get_user_bookings(user_id)), 200
+    cache_key = ResponseCache.make_key("bookings", [user_id, version])
+    cached = bookings_cache.get(cache_key, max_age=BOOKINGS_CACHE_TTL)
+    if cached:
+        return jsonify(cached[0]), 200
     bookings = db_manager.get_user_bookings(user_id)
+    bookings_cache.put(cache_key, bookings)
     return jsonify(bookings), 200
 
+@app.route('/api/admin/stats', methods=['GET'])
+@admin_required
+def admin_stats():
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if not 1 <= limit <= 200:
+        return jsonify({"error": "limit must be between 1 and 200"}), 400
+    try:
+        last_day = date.fromisoformat(request.args.get('to') or date.today().isoformat())
+        first_day = date.fromisoformat(request.args.get('from') or (last_day - timedelta(days=29)).isoformat())
+    except ValueError:
+        return jsonify({"error": "from and to must be dates in YYYY-MM-DD format"}), 400
+    if first_day > last_day or (last_day - first_day).days >= 366:
+        return jsonify({"error": "from must not be after to, and the range must be at most 366 days"}), 400
+    
+    totals = db_manager.get_booking_rollups("all", 1)
+    cities = db_manager.get_booking_rollups("city", limit)
+    hotels = db_manager.get_booking_rollups("hotel", limit)
+    days = db_manager.get_booking_rollups("day", 366, first_day.isoformat(), last_day.isoformat())
+    if None in (totals, cities, hotels, days):
+        return jsonify({"error": "Failed to fetch booking stats"}), 500
+    total = totals[0] if totals else {"bookings": 0, "room_nights": 0, "revenue": 0, "avg_nightly_price": None}
+    return jsonify({
+        "currency": BASE_CURRENCY,
+        "totals": {k: total[k] for k in ("bookings", "room_nights", "revenue", "avg_nightly_price")},
+        "cities": cities,
+        "hotels": hotels,
+        "days": days,
+        "from": first_day.isoformat(),
+        "to": last_day.isoformat()
+    }), 200
+
+BOOKING_EXPORT_COLUMNS = ["id", "user_id", "hotel_name", "hotel_id", "city", "check_in", "check_out", "room_type",
+                          "rooms", "total_price", "booking_date"]
+BOOKING_EXPORT_CHUNK_SIZE = int(os.environ.get("BOOKING_EXPORT_CHUNK_SIZE", "1000"))
+
+# Encodes rows a chunk at a time; memory stays at one chunk whatever the number of bookings
+def export_chunks(rows, export_format):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if export_format == "csv":
+        writer.writerow(BOOKING_EXPORT_COLUMNS)
+    for count, row in enumerate(rows, 1):
+        if export_format == "csv":
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(dict(zip(BOOKING_EXPORT_COLUMNS, row))) + "\n")
+        if count % BOOKING_EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def booking_export_response(user_id=None):
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'jsonl'):
+        return jsonify({"error": "format must be csv or jsonl"}), 400
+    try:
+        first_day = date.fromisoformat(request.args['from']).isoformat() if request.args.get('from') else None
+        last_day = date.fromisoformat(request.args['to']).isoformat() if request.args.get('to') else None
+    except ValueError:
+        return jsonify({"error": "from and to must be dates in YYYY-MM-DD format"}), 400
+    
+    rows = db_manager.iter_bookings(user_id, first_day, last_day, BOOKING_EXPORT_CHUNK_SIZE)
+    mimetype = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    response = Response(stream_with_context(export_chunks(rows, export_format)), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=bookings.{export_format}"
+    return response
+
+@app.route('/api/admin/bookings/export', methods=['GET'])
+@admin_required
+def export_bookings():
+    try:
+        user_id = int(request.args['user_id']) if request.args.get('user_id') else None
+    except ValueError:
+        return jsonify({"error": "user_id must be an integer"}), 400
+    return booking_export_response(user_id)
+
+@app.route('/api/bookings/<int:user_id>/export', methods=['GET'])
+def export_user_bookings(user_id):
+    return booking_export_response(user_id)
+
+# flask --app api rebuild-rollups
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recompute the booking_rollups table from all bookings."""
+    started = time.perf_counter()
+    rows = db_manager.rebuild_booking_rollups()
+    click.echo(f"Rebuilt {rows} rollup rows in {time.perf_counter() - started:.2f}s")
+
+# Yields (line number, record) from a CSV or JSONL file without reading it whole; a record is a dict,
+# or an error string for a line that could not be parsed
+def read_import_records(path, file_format):
+    with open(path, newline='', encoding='utf-8') as f:
+        if file_format == "csv":
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield reader.line_num, {k: v for k, v in record.items() if k is not None}
+            return
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, f"Invalid JSON: {e}"
+                continue
+            yield line_number, record if isinstance(record, dict) else "Expected a JSON object"
+
+# Loads users or historical bookings in bulk for migrations. Each batch is validated with a few set
+# lookups and written with executemany in one transaction; secondary indexes on the target tables are
+# dropped for the load and recreated once at the end, and booking rollups are rebuilt afterwards.
+# Bookings skip availability and payment checks: they already happened in the previous system.
+class BulkImporter:
+    TABLES = {"users": ("users",), "bookings": ("bookings", "room_reservations")}
+
+    def __init__(self, kind, batch_size=5000, errors_path=None):
+        self.kind = kind
+        self.batch_size = batch_size
+        self.errors_path = errors_path
+        self.stats = {"read": 0, "imported": 0, "rejected": 0}
+        self.errors = []
+
+    def run(self, records, progress=None):
+        started = time.perf_counter()
+        conn = sqlite3.connect('hotel_booking.db', timeout=30, isolation_level=None)
+        errors_file = open(self.errors_path, "w") if self.errors_path else None
+        deferred = self._drop_indexes(conn)
+        records = iter(records)
+        try:
+            while True:
+                batch = list(itertools.islice(records, self.batch_size))
+                if not batch:
+                    break
+                self.stats["read"] += len(batch)
+                rows, errors = self._validate(conn.cursor(), batch)
+                if rows:
+                    cursor = conn.cursor()
+                    cursor.execute('BEGIN IMMEDIATE')
+                    try:
+                        self._insert(cursor, rows)
+                        cursor.execute('COMMIT')
+                    except (sqlite3.Error, ValueError):
+                        conn.rollback()
+                        raise
+                self.stats["imported"] += len(rows)
+                self._reject(errors, errors_file)
+                if progress:
+                    progress(self.stats, time.perf_counter() - started)
+        finally:
+            for sql in deferred:
+                conn.execute(sql)
+            conn.close()
+            if errors_file:
+                errors_file.close()
+        if self.kind == "bookings" and self.stats["imported"]:
+            db_manager.rebuild_booking_rollups()
+        elapsed = time.perf_counter() - started
+        self.stats["seconds"] = round(elapsed, 2)
+        self.stats["rows_per_sec"] = round(self.stats["imported"] / max(elapsed, 1e-9))
+        return self.stats
+
+    # Returns the CREATE statements of the dropped indexes; unique constraints stay, they back validation
+    def _drop_indexes(self, conn):
+        tables = self.TABLES[self.kind]
+        indexes = conn.execute(f'''
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({",".join("?" * len(tables))})
+        ''', tables).fetchall()
+        for name, _ in indexes:
+            conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+        return [sql for _, sql in indexes]
+
+    def _reject(self, errors, errors_file):
+        self.stats["rejected"] += len(errors)
+        for line_number, error, record in errors:
+            if len(self.errors) < IMPORT_ERRORS_SHOWN:
+                self.errors.append((line_number, error))
+            if errors_file:
+                errors_file.write(json.dumps({"line": line_number, "error": error, "record": record}) + "\n")
+
+    def _validate(self, cursor, batch):
+        rows, errors = [], []
+        parsed = []
+        for line_number, record in batch:
+            if isinstance(record, str):
+                errors.append((line_number, record, None))
+                continue
+            try:
+                parsed.append((line_number, record, self._parse(record)))
+            except KeyError as e:
+                errors.append((line_number, f"Missing field {e}", record))
+            except (ValueError, TypeError) as e:
+                errors.append((line_number, str(e), record))
+        if self.kind == "users":
+            usernames = set(self._user_ids(cursor, "username", [user["username"] for _, _, user in parsed]))
+            emails = set(self._user_ids(cursor, "email", [user["email"] for _, _, user in parsed]))
+            for line_number, record, user in parsed:
+                if user["username"] in usernames or user["email"] in emails:
+                    errors.append((line_number, "Username or email already exists", record))
+                    continue
+                usernames.add(user["username"])
+                emails.add(user["email"])
+                rows.append(user)
+        else:
+            user_ids = self._user_ids(cursor, "id", [b["user_id"] for _, _, b in parsed if b["user_id"] is not None])
+            usernames = self._user_ids(cursor, "username", [b["username"] for _, _, b in parsed if b["user_id"] is None])
+            for line_number, record, booking in parsed:
+                booking["user_id"] = user_ids.get(booking["user_id"]) or usernames.get(booking["username"])
+                if booking["user_id"] is None:
+                    errors.append((line_number, "Unknown user", record))
+                    continue
+                rows.append(booking)
+        return rows, sorted(errors, key=lambda error: error[0])
+
+    # Maps the given values of a users column to user ids, for the values that exist
+    def _user_ids(self, cursor, column, values):
+        values = list(set(values))
+        if not values:
+            return {}
+        cursor.execute(f'SELECT {column}, id FROM users WHERE {column} IN ({",".join("?" * len(values))})', values)
+        return dict(cursor.fetchall())
+
+    def _parse(self, record):
+        record = {k: v.strip() if isinstance(v, str) else v for k, v in record.items()}
+        if self.kind == "users":
+            if not record.get("username") or not record.get("email"):
+                raise ValueError("username and email are required")
+            password_hash = record.get("password_hash")
+            if password_hash:
+                if not re.fullmatch(r"[0-9a-f]{64}", password_hash):
+                    raise ValueError("password_hash must be a hex SHA-256 digest")
+            elif record.get("password"):
+                password_hash = hash_password(record["password"])
+            else:
+                raise ValueError("password or password_hash is required")
+            return {"username": record["username"], "password": password_hash, "email": record["email"],
+                    "full_name": record.get("full_name") or None}
+        user_id = int(record["user_id"]) if record.get("user_id") not in (None, "") else None
+        if user_id is None and not record.get("username"):
+            raise ValueError("user_id or username is required")
+        check_in = date.fromisoformat(record["check_in"])
+        check_out = date.fromisoformat(record["check_out"])
+        if check_out <= check_in:
+            raise ValueError("check_out must be after check_in")
+        total_price = float(record["total_price"])
+        rooms = int(record.get("rooms") or 1)
+        if total_price < 0 or rooms < 1:
+            raise ValueError("total_price must not be negative and rooms must be at least 1")
+        if not record.get("hotel_name") or not record.get("city"):
+            raise ValueError("hotel_name and city are required")
+        booking_date = record.get("booking_date")
+        booking_date = (datetime.fromisoformat(booking_date).strftime('%Y-%m-%d %H:%M:%S') if booking_date
+                        else time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+        return {"user_id": user_id, "username": record.get("username"), "hotel_name": record["hotel_name"],
+                "hotel_id": record.get("hotel_id") or None, "city": record["city"], "check_in": check_in.isoformat(),
+                "check_out": check_out.isoformat(), "room_type": record.get("room_type") or "Standard Room",
+                "total_price": total_price, "rooms": rooms, "booking_date": booking_date}
+
+    def _insert(self, cursor, rows):
+        if self.kind == "users":
+            cursor.executemany('''
+                INSERT INTO users (username, password, email, full_name)
+                VALUES (:username, :password, :email, :full_name)
+            ''', rows)
+            return
+        # Ids are assigned up front (the write lock is held) so reservations can reference their bookings
+        first_id = cursor.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM bookings').fetchone()[0]
+        for booking_id, booking in enumerate(rows, first_id):
+            booking["id"] = booking_id
+        cursor.executemany('''
+            INSERT INTO bookings (id, user_id, hotel_name, hotel_id, city, check_in, check_out, room_type,
+                                  total_price, booking_date)
+            VALUES (:id, :user_id, :hotel_name, :hotel_id, :city, :check_in, :check_out, :room_type,
+                    :total_price, :booking_date)
+        ''', rows)
+        # Only stays that have not ended yet hold rooms, as in _backfill_reservations
+        today = date.today().isoformat()
+        upcoming = [b for b in rows if b["hotel_id"] and b["check_out"] > today]
+        if not upcoming:
+            return
+        first_id = cursor.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM room_reservations').fetchone()[0]
+        hotel_keys = {hotel_id: db_manager.get_hotel_key(cursor, hotel_id, create=True)
+                      for hotel_id in {b["hotel_id"] for b in upcoming}}
+        reservations = [(reservation_id, b["id"], b["hotel_id"], b["room_type"], b["check_in"], b["check_out"], b["rooms"])
+                        for reservation_id, b in enumerate(upcoming, first_id)]
+        cursor.executemany('''
+            INSERT INTO room_reservations (id, booking_id, hotel_id, room_type, check_in, check_out, rooms)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', reservations)
+        cursor.executemany('INSERT INTO room_reservation_index VALUES (?, ?, ?, ?, ?)', [
+            (r[0], hotel_keys[r[2]], hotel_keys[r[2]],
+             date.fromisoformat(r[4]).toordinal(), date.fromisoformat(r[5]).toordinal() - 1) for r in reservations])
+
+IMPORT_ERRORS_SHOWN = 20
+
+def run_import(kind, path, file_format, batch_size, errors_path):
+    file_format = file_format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    importer = BulkImporter(kind, batch_size, errors_path)
+    stats = importer.run(read_import_records(path, file_format),
+                         progress=lambda s, elapsed: click.echo(f"  {s['read']:,} read, {s['imported']:,} imported, "
+                                                                f"{s['rejected']:,} rejected ({s['imported'] / max(elapsed, 1e-9):,.0f} rows/s)"))
+    for line_number, error in importer.errors:
+        click.echo(f"  line {line_number}: {error}", err=True)
+    if stats["rejected"] > len(importer.errors):
+        click.echo(f"  ... {stats['rejected'] - len(importer.errors):,} more"
+                   + (f", all rejected rows are in {errors_path}" if errors_path else ""), err=True)
+    click.echo(f"Imported {stats['imported']:,} of {stats['read']:,} {kind} in {stats['seconds']:.2f}s "
+               f"({stats['rows_per_sec']:,} rows/s), {stats['rejected']:,} rejected")
+
+# flask --app api import-bookings bookings.csv --errors rejected.jsonl
+@app.cli.command("import-bookings")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["csv", "jsonl"]), help="Defaults to the file extension.")
+@click.option("--batch-size", type=click.IntRange(1, 30000), default=5000, show_default=True,
+              help="Rows validated and committed together.")
+@click.option("--errors", "errors_path", help="Write rejected rows with their errors to this JSONL file.")
+def import_bookings_command(path, file_format, batch_size, errors_path):
+    """Bulk-load historical bookings from a CSV or JSONL file."""
+    run_import("bookings", path, file_format, batch_size, errors_path)
+
+# flask --app api import-users users.jsonl
+@app.cli.command("import-users")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["csv", "jsonl"]), help="Defaults to the file extension.")
+@click.option("--batch-size", type=click.IntRange(1, 30000), default=5000, show_default=True,
+              help="Rows validated and committed together.")
+@click.option("--errors", "errors_path", help="Write rejected rows with their errors to this JSONL file.")
+def import_users_command(path, file_format, batch_size, errors_path):
+    """Bulk-load users from a CSV or JSONL file."""
+    run_import("users", path, file_format, batch_size, errors_path)
+
 @app.route('/api/chat', methods=['POST'])
+@rate_limited("chat")
 def chat():
     data = request.get_json()
     
@@ -11,6 +11,11 @@ import logging
 import time
 import random
 import hashlib
+import itertools
+import html
+import json
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 load_dotenv()
@@ -95,6 +100,23 @@ st.markdown("""
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+# Rooms assumed per hotel and room type when no room_inventory row has been configured
+DEFAULT_ROOMS_PER_TYPE = int(os.environ.get("DEFAULT_ROOMS_PER_TYPE", "10"))
+
+# Booking analytics rollups, shared with api.py (see BOOKING_ROLLUP_DIMENSIONS there)
+BOOKING_ROLLUP_DIMENSIONS = {
+    "all": ("'all'", "NULL"),
+    "city": ("COALESCE(LOWER(TRIM(b.city)), '')", "TRIM(b.city)"),
+    "hotel": ("COALESCE(b.hotel_id, b.hotel_name, '')", "b.hotel_name"),
+    "day": ("DATE(b.booking_date)", "NULL"),
+}
+BOOKING_ROOM_NIGHTS_SQL = ("CAST(julianday(b.check_out) - julianday(b.check_in) AS INTEGER) * "
+                           "COALESCE((SELECT SUM(r.rooms) FROM room_reservations AS r WHERE r.booking_id = b.id), 1)")
+
+# Raised by save_booking when the requested rooms are no longer free for the dates
+class RoomsUnavailableError(Exception):
+    pass
+
 # Database Manager Class
 class DatabaseManager:
     def __init__(self):
@@ -128,6 +150,52 @@ class DatabaseManager:
                     FOREIGN KEY(user_id) REFERENCES users(id)
                 )
             ''')
+            # Local room inventory, shared with api.py (see DatabaseManager there)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS room_inventory (
+                    hotel_id TEXT NOT NULL,
+                    room_type TEXT NOT NULL,
+                    total_rooms INTEGER NOT NULL,
+                    PRIMARY KEY (hotel_id, room_type)
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS inventory_hotels (
+                    id INTEGER PRIMARY KEY,
+                    hotel_id TEXT UNIQUE NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS room_reservations (
+                    id INTEGER PRIMARY KEY,
+                    booking_id INTEGER,
+                    hotel_id TEXT NOT NULL,
+                    room_type TEXT NOT NULL,
+                    check_in DATE NOT NULL,
+                    check_out DATE NOT NULL,
+                    rooms INTEGER NOT NULL DEFAULT 1,
+                    FOREIGN KEY(booking_id) REFERENCES bookings(id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS room_reservation_index
+                USING rtree_i32(id, hotel_min, hotel_max, night_min, night_max)
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS booking_rollups (
+                    dimension TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    label TEXT,
+                    bookings INTEGER NOT NULL DEFAULT 0,
+                    room_nights INTEGER NOT NULL DEFAULT 0,
+                    revenue REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (dimension, key)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_booking_rollups_revenue
+                ON booking_rollups (dimension, revenue DESC)
+            ''')
             conn.commit()
         except sqlite3.Error as e:
             logging.error(f"Database error during table creation: {e}")
@@ -165,22 +233,116 @@ class DatabaseManager:
         finally:
             conn.close()
 
-    def save_booking(self, user_id, hotel_name, hotel_id, city, check_in, check_out, room_type, total_price):
+    # Integer key of a hotel in room_reservation_index, created on first use when create=True
+    def _hotel_key(self, cursor, hotel_id, create=False):
+        cursor.execute('SELECT id FROM inventory_hotels WHERE hotel_id = ?', (hotel_id,))
+        row = cursor.fetchone()
+        if row:
+            return row[0]
+        if not create:
+            return None
+        cursor.execute('INSERT INTO inventory_hotels (hotel_id) VALUES (?)', (hotel_id,))
+        return cursor.lastrowid
+
+    def _insert_reservation(self, cursor, booking_id, hotel_id, room_type, check_in, check_out, rooms):
+        cursor.execute('''
+            INSERT INTO room_reservations (booking_id, hotel_id, room_type, check_in, check_out, rooms)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (booking_id, hotel_id, room_type, check_in, check_out, rooms))
+        hotel_key = self._hotel_key(cursor, hotel_id, create=True)
+        # Nights are stored as date ordinals; a stay occupies check_in .. check_out - 1
+        cursor.execute('INSERT INTO room_reservation_index VALUES (?, ?, ?, ?, ?)',
+                       (cursor.lastrowid, hotel_key, hotel_key,
+                        date.fromisoformat(check_in).toordinal(), date.fromisoformat(check_out).toordinal() - 1))
+
+    # Free rooms per hotel for the nights [check_in, check_out), answered for all hotels at once
+    def _available_rooms(self, cursor, hotel_ids, check_in, check_out, room_type):
+        first_night = date.fromisoformat(check_in).toordinal()
+        last_night = date.fromisoformat(check_out).toordinal() - 1
+        nights = last_night - first_night + 1
+        hotel_ids = list(dict.fromkeys(hotel_ids))
+        placeholders = ",".join("(?)" for _ in hotel_ids)
+        cursor.execute(f'''
+            WITH page(hotel_id) AS (VALUES {placeholders})
+            SELECT page.hotel_id, i.night_min, i.night_max, r.rooms
+            FROM page
+            JOIN inventory_hotels h ON h.hotel_id = page.hotel_id
+            JOIN room_reservation_index i
+                ON i.hotel_min = h.id AND i.hotel_max = h.id AND i.night_min <= ? AND i.night_max >= ?
+            JOIN room_reservations r ON r.id = i.id
+            WHERE r.room_type = ?
+        ''', (*hotel_ids, last_night, first_night, room_type))
+        # Difference array per hotel gives the busiest night in the range
+        occupancy = {}
+        for hotel_id, night_min, night_max, rooms in cursor.fetchall():
+            changes = occupancy.setdefault(hotel_id, [0] * (nights + 1))
+            changes[max(night_min, first_night) - first_night] += rooms
+            changes[min(night_max, last_night) - first_night + 1] -= rooms
+        cursor.execute(f'''
+            SELECT hotel_id, total_rooms FROM room_inventory
+            WHERE room_type = ? AND hotel_id IN ({",".join("?" for _ in hotel_ids)})
+        ''', (room_type, *hotel_ids))
+        capacity = dict(cursor.fetchall())
+        available = {}
+        for hotel_id in hotel_ids:
+            peak = max(itertools.accumulate(occupancy[hotel_id][:-1])) if hotel_id in occupancy else 0
+            available[hotel_id] = max(0, capacity.get(hotel_id, DEFAULT_ROOMS_PER_TYPE) - peak)
+        return available
+
+    def get_available_rooms(self, hotel_ids, check_in, check_out, room_type="Standard Room"):
+        if not hotel_ids:
+            return {}
         conn = sqlite3.connect('hotel_booking.db')
+        try:
+            return self._available_rooms(conn.cursor(), hotel_ids, check_in, check_out, room_type)
+        except sqlite3.Error as e:
+            logging.error(f"Database error during availability lookup: {e}")
+            return {}
+        finally:
+            conn.close()
+
+    def save_booking(self, user_id, hotel_name, hotel_id, city, check_in, check_out, room_type, total_price, rooms=1):
+        # Autocommit mode so BEGIN IMMEDIATE below controls the transaction
+        conn = sqlite3.connect('hotel_booking.db', timeout=30, isolation_level=None)
         try:
             cursor = conn.cursor()
+            # Take the write lock before checking, so two sessions cannot both get the last room
+            cursor.execute('BEGIN IMMEDIATE')
+            available = self._available_rooms(cursor, [hotel_id], check_in, check_out, room_type)[hotel_id]
+            if available < rooms:
+                cursor.execute('ROLLBACK')
+                raise RoomsUnavailableError(f"Only {available} room(s) left for {hotel_id} between {check_in} and {check_out}")
             cursor.execute('''
                 INSERT INTO bookings (user_id, hotel_name, hotel_id, city, check_in, check_out, room_type, total_price)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ''', (user_id, hotel_name, hotel_id, city, check_in, check_out, room_type, total_price))
-            conn.commit()
-            return cursor.lastrowid
+            booking_id = cursor.lastrowid
+            self._insert_reservation(cursor, booking_id, hotel_id, room_type, check_in, check_out, rooms)
+            self._add_to_rollups(cursor, booking_id)
+            cursor.execute('COMMIT')
+            return booking_id
         except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
             logging.error(f"Database error during booking save: {e}")
             return None
         finally:
             conn.close()
 
+    # Adds one booking to every rollup, inside the caller's transaction
+    def _add_to_rollups(self, cursor, booking_id):
+        for dimension, (key_sql, label_sql) in BOOKING_ROLLUP_DIMENSIONS.items():
+            cursor.execute(f'''
+                INSERT INTO booking_rollups (dimension, key, label, bookings, room_nights, revenue)
+                SELECT ?, {key_sql}, {label_sql}, 1, {BOOKING_ROOM_NIGHTS_SQL}, COALESCE(b.total_price, 0)
+                FROM bookings AS b WHERE b.id = ?
+                ON CONFLICT(dimension, key) DO UPDATE SET
+                    label = COALESCE(excluded.label, label),
+                    bookings = bookings + excluded.bookings,
+                    room_nights = room_nights + excluded.room_nights,
+                    revenue = revenue + excluded.revenue
+            ''', (dimension, booking_id))
+
     def get_user_bookings(self, username):
         conn = sqlite3.connect('hotel_booking.db')
         try:
@@ -209,6 +371,27 @@ class DatabaseManager:
         finally:
             conn.close()
 
+class PaymentDeclinedError(Exception):
+    pass
+
+# Stands in for a payment gateway; swap in any object with the same charge()/refund() methods
+class MockPaymentProcessor:
+    DECLINED_CARD = "4000000000000002"
+
+    def __init__(self, delay=2.0):
+        self.delay = delay
+
+    # Same interface as the API's processor: payment is the card details dict
+    # (card_number, expiry, cvv, cardholder). Returns a transaction id or raises PaymentDeclinedError
+    def charge(self, amount, payment):
+        time.sleep(self.delay)
+        if payment.get('card_number') == self.DECLINED_CARD:
+            raise PaymentDeclinedError("Card declined")
+        return random.randint(100000, 999999)
+
+    def refund(self, transaction_id):
+        logging.info(f"Refunded transaction {transaction_id}")
+
 # Google Hotels API Client Class
 class GoogleHotelsAPIClient:
     BASE_URL = "https://serpapi.com/search.json"
@@ -324,6 +507,10 @@ if 'transaction_id' not in st.session_state:
     st.session_state['transaction_id'] = None
 if 'current_search_params' not in st.session_state:
     st.session_state['current_search_params'] = None
+if 'payment_job' not in st.session_state:
+    st.session_state['payment_job'] = None
+if 'results_page' not in st.session_state:
+    st.session_state['results_page'] = 0
 # Initialize form state variables
 if 'form_destination' not in st.session_state:
     st.session_state['form_destination'] = "faridabad"
@@ -366,10 +553,114 @@ if 'form_bathrooms' not in st.session_state:
 if 'reset_filters_confirm' not in st.session_state:
     st.session_state['reset_filters_confirm'] = False
 
+# Number of hotel cards rendered per results page
+RESULTS_PAGE_SIZE = int(os.environ.get("RESULTS_PAGE_SIZE", "10"))
+
+# Chat messages drawn per rerun and sent to the LLM per turn
+CHAT_RENDER_WINDOW = int(os.environ.get("CHAT_RENDER_WINDOW", "50"))
+CHAT_CONTEXT_MESSAGES = int(os.environ.get("CHAT_CONTEXT_MESSAGES", "20"))
+
+# Database manager and API clients are created once per server process instead of on every
+# rerun (Streamlit re-executes this whole script on each widget interaction)
+@st.cache_resource
+def get_db_manager():
+    return DatabaseManager()
+
+@st.cache_resource
+def get_google_hotels_client():
+    return GoogleHotelsAPIClient()
+
+@st.cache_resource
+def get_groq_client():
+    return Groq(api_key=os.environ.get("GROQ_API_KEY"))
+
+# Payments run on this pool so the script run that submitted them returns immediately
+@st.cache_resource
+def get_payment_executor():
+    return ThreadPoolExecutor(max_workers=int(os.environ.get("BOOKING_JOB_WORKERS", "4")), thread_name_prefix="payment")
+
+@st.cache_resource
+def get_payment_processor():
+    return MockPaymentProcessor(delay=float(os.environ.get("PAYMENT_MOCK_DELAY", "2")))
+
+# Runs on the payment pool: charges the card, then stores the booking. Returns a result dict.
+def run_payment_job(processor, username, hotel_data, params, rooms, total_price, payment):
+    try:
+        transaction_id = processor.charge(total_price, payment)
+    except PaymentDeclinedError as e:
+        logging.warning(f"Payment declined: {e}")
+        return {"error": "declined"}
+    try:
+        booking_id = db_manager.save_booking(
+            user_id=db_manager.get_user_id(username),
+            hotel_name=hotel_data['name'],
+            hotel_id=hotel_data['property_token'],
+            city=params['destination'],
+            check_in=params['check_in'].strftime("%Y-%m-%d"),
+            check_out=params['check_out'].strftime("%Y-%m-%d"),
+            room_type="Standard Room",
+            total_price=total_price,
+            rooms=rooms
+        )
+    except RoomsUnavailableError as e:
+        logging.warning(f"Booking rejected: {e}")
+        processor.refund(transaction_id)
+        return {"error": "rooms_unavailable"}
+    if not booking_id:
+        processor.refund(transaction_id)
+        return {"error": "failed"}
+    return {"booking_id": booking_id, "transaction_id": transaction_id}
+
+# Raised inside the cached search so failed searches are not memoized
+class SearchFailedError(Exception):
+    pass
+
+# Identical searches (same parameter dict) within RESPONSE_CACHE_TTL seconds reuse the first result
+@st.cache_data(ttl=int(os.environ.get("RESPONSE_CACHE_TTL", "600")), max_entries=200, show_spinner=False)
+def cached_search_hotels(search_params):
+    results = get_google_hotels_client().search_hotels(**search_params)
+    if results is None:
+        raise SearchFailedError()
+    return results
+
+def normalize_destination(text):
+    text = unicodedata.normalize("NFKD", text or "")
+    return " ".join(re.findall(r"\w+", "".join(c for c in text if not unicodedata.combining(c)).lower()))
+
+# Spellings from the bundled city list ("bombay", "Faridabad, Haryana") mapped to one canonical name
+@st.cache_resource
+def get_destination_forms():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "destinations.json")
+    forms = {}
+    try:
+        with open(path) as f:
+            entries = json.load(f)["destinations"]
+    except (OSError, ValueError, KeyError) as e:
+        logging.error(f"Could not load destinations from {path}: {e}")
+        return forms
+    for entry in entries:
+        name, region, country = entry["name"], entry.get("region"), entry.get("country")
+        for form in [name] + entry.get("aliases", []) + [" ".join(filter(None, parts)) for parts in
+                                                         ((name, region), (name, country), (name, region, country))]:
+            forms.setdefault(normalize_destination(form), name)
+    return forms
+
+# Variants of one destination share a cache entry and an upstream search
+def canonical_destination(text):
+    cleaned = " ".join((text or "").split())
+    return get_destination_forms().get(normalize_destination(cleaned), cleaned)
+
+def search_hotels_cached(search_params):
+    search_params = dict(search_params, q=canonical_destination(search_params.get("q")))
+    try:
+        return cached_search_hotels(search_params)
+    except SearchFailedError:
+        return None
+
 # Initialize database and API clients
-db_manager = DatabaseManager()
+db_manager = get_db_manager()
 try:
-    google_hotels_client = GoogleHotelsAPIClient()
+    google_hotels_client = get_google_hotels_client()
 except ValueError:
     st.stop()
 
@@ -441,7 +732,7 @@ def main_app():
                 st.session_state.clear()
                 st.rerun()
 
-    groq_client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+    groq_client = get_groq_client()
     if not groq_client.api_key:
         st.error("GROQ_API_KEY environment variable is not set")
         st.stop()
@@ -453,10 +744,19 @@ def main_app():
     elif page == "💬 Chat with Bot":
         chat_page(groq_client)
 
-# Function to check room availability (mock implementation)
+# A hotel is bookable when SerpApi has a rate for it and the local inventory has a free room
 def check_room_availability(hotel):
     extracted_rate = hotel.get('total_rate', {}).get('extracted_lowest', None)
-    return extracted_rate is not None
+    return extracted_rate is not None and hotel.get('available_rooms', 1) > 0
+
+# Fills in available_rooms for a page of properties with one batched inventory lookup
+def add_availability(properties, check_in, check_out):
+    hotel_ids = [prop['property_token'] for prop in properties if prop.get('property_token')]
+    available = db_manager.get_available_rooms(hotel_ids, check_in.strftime("%Y-%m-%d"), check_out.strftime("%Y-%m-%d"))
+    for prop in properties:
+        if prop.get('property_token') in available:
+            prop['available_rooms'] = available[prop['property_token']]
+    return properties
 
 # Search Hotels Page
 def search_hotels_page(google_hotels_client):
@@ -638,9 +938,9 @@ def search_hotels_page(google_hotels_client):
                 search_params["special_offers"] = "true"
 
         with st.spinner("Searching for hotels..."):
-            search_results = google_hotels_client.search_hotels(**search_params)
+            search_results = search_hotels_cached(search_params)
             if search_results:
-                properties = search_results.get("properties", [])
+                properties = add_availability(search_results.get("properties", []), check_in, check_out)
                 st.session_state['search_results'] = properties
                 st.session_state['next_page_token'] = search_results.get("serpapi_pagination", {}).get("next_page_token")
                 st.session_state['booking_params'] = {
@@ -651,20 +951,29 @@ def search_hotels_page(google_hotels_client):
                     'rooms': rooms
                 }
                 st.session_state['current_search_params'] = search_params
+                st.session_state['results_page'] = 0
                 if not properties:
                     st.info("No hotels found matching your criteria. Try adjusting your search parameters.")
 
     if st.session_state.get('search_results'):
         current_destination = st.session_state.get('booking_params', {}).get('destination', 'your search')
         st.markdown(f'<h2 class="subheader">🏨 Hotels in {current_destination}</h2>', unsafe_allow_html=True)
+        results = st.session_state['search_results']
+        total_pages = (len(results) + RESULTS_PAGE_SIZE - 1) // RESULTS_PAGE_SIZE
+        page = min(st.session_state['results_page'], total_pages - 1)
+        st.session_state['results_page'] = page
+        start = page * RESULTS_PAGE_SIZE
+        st.caption(f"Showing {start + 1}-{min(start + RESULTS_PAGE_SIZE, len(results))} of {len(results)} hotels")
         with st.spinner("Loading search results..."):
-            for prop in st.session_state['search_results']:
+            # Only the current window is rendered, so reruns cost the same however many pages were loaded
+            for prop in results[start:start + RESULTS_PAGE_SIZE]:
                 with st.container():
                     st.markdown('<div class="hotel-card">', unsafe_allow_html=True)
                     col1, col2, col3, col4 = st.columns([1, 2, 1, 1])
                     with col1:
                         if 'images' in prop and prop['images']:
-                            st.image(prop['images'][0]['thumbnail'], width=100)
+                            # Plain <img> so the browser defers off-screen thumbnails instead of Streamlit fetching them
+                            st.markdown(f'<img src="{html.escape(prop["images"][0]["thumbnail"])}" width="100" loading="lazy">', unsafe_allow_html=True)
                         else:
                             st.write("No image")
                     with col2:
@@ -691,22 +1000,52 @@ def search_hotels_page(google_hotels_client):
                             st.markdown('<div class="unavailable-message">No rooms available for your dates.</div>', unsafe_allow_html=True)
                     st.markdown('</div>', unsafe_allow_html=True)
 
+        if total_pages > 1:
+            render_page_controls(page, total_pages)
+
         if st.session_state['next_page_token']:
             if st.button("📄 Load Next Page", key="load_next_page"):
                 search_params = st.session_state['current_search_params']
                 search_params['next_page_token'] = st.session_state['next_page_token']
                 with st.spinner("Loading more hotels..."):
-                    search_results = google_hotels_client.search_hotels(**search_params)
+                    search_results = search_hotels_cached(search_params)
                     if search_results:
-                        properties = search_results.get("properties", [])
+                        booking_params = st.session_state['booking_params']
+                        properties = add_availability(search_results.get("properties", []), booking_params['check_in'], booking_params['check_out'])
+                        previous_count = len(st.session_state['search_results'])
                         st.session_state['search_results'].extend(properties)
+                        # Jump to the window holding the first newly loaded hotel
+                        st.session_state['results_page'] = previous_count // RESULTS_PAGE_SIZE
                         st.session_state['next_page_token'] = search_results.get("serpapi_pagination", {}).get("next_page_token")
                         st.rerun()
 
-        if len(st.session_state['search_results']) > 5:
+        if min(RESULTS_PAGE_SIZE, len(results)) > 5:
             if st.button("⬆️ Back to Top", key="back_to_top"):
                 st.markdown('<script>window.scrollTo(0, 0);</script>', unsafe_allow_html=True)
 
+def render_page_controls(page, total_pages):
+    col1, col2, col3, col4, col5 = st.columns([1, 1, 2, 1, 1])
+    new_page = page
+    with col1:
+        if st.button("⏮️ First", key="results_first", disabled=page == 0):
+            new_page = 0
+    with col2:
+        if st.button("◀️ Prev", key="results_prev", disabled=page == 0):
+            new_page = page - 1
+    with col3:
+        jump = st.number_input("Page", min_value=1, max_value=total_pages, value=page + 1, key=f"results_jump_{page}_{total_pages}")
+        if jump - 1 != page:
+            new_page = jump - 1
+    with col4:
+        if st.button("Next ▶️", key="results_next", disabled=page >= total_pages - 1):
+            new_page = page + 1
+    with col5:
+        if st.button("Last ⏭️", key="results_last", disabled=page >= total_pages - 1):
+            new_page = total_pages - 1
+    if new_page != page:
+        st.session_state['results_page'] = new_page
+        st.rerun()
+
 # Separate functions for different booking stages
 def show_booking_summary():
     hotel_data = st.session_state['selected_hotel']
@@ -729,7 +1068,8 @@ def show_booking_summary():
         nights = (params['check_out'] - params['check_in']).days
         st.write(f"🌙 **Nights**: {nights}")
         st.write(f"👥 **Number of People**: {params['num_people']}")
-        rooms = st.number_input("🛏️ Number of Rooms", min_value=1, max_value=5, value=params['rooms'])
+        max_rooms = max(1, min(5, hotel_data.get('available_rooms', 5)))
+        rooms = st.number_input("🛏️ Number of Rooms", min_value=1, max_value=max_rooms, value=min(params['rooms'], max_rooms))
         total_rate = hotel_data.get('total_rate', {}).get('extracted_lowest', 0.0)
         total_price = total_rate * rooms if total_rate else 0.0
         st.markdown(f"💰 **Total Price for {rooms} room(s)**: ₹{total_price:.2f}")
@@ -765,6 +1105,12 @@ def show_payment_page():
     st.markdown(f'<h2 class="subheader">💳 Payment for {hotel_data["name"]}</h2>', unsafe_allow_html=True)
     st.markdown(f"💰 **Total Price**: ₹{total_price:.2f} for {rooms} room(s)")
 
+    if st.session_state.get('payment_job') is not None:
+        payment_status_fragment()
+        return
+    if st.session_state.get('payment_error'):
+        st.markdown(f'<div class="error-message">{st.session_state.pop("payment_error")}</div>', unsafe_allow_html=True)
+
     back_button = st.button("⬅️ Back to Booking Summary", key="back_from_payment")
     if back_button:
         st.session_state['show_payment'] = False
@@ -782,28 +1128,38 @@ def show_payment_page():
             if len(card_number) != 16 or not is_expiry_valid(expiry) or len(cvv) != 3 or not cardholder:
                 st.markdown('<div class="error-message">Invalid payment details. Please use a 16-digit card number, MM/YY expiry format, 3-digit CVV, and enter the cardholder name.</div>', unsafe_allow_html=True)
             else:
-                with st.spinner("Processing payment..."):
-                    time.sleep(2)
-                transaction_id = random.randint(100000, 999999)
-                booking_id = db_manager.save_booking(
-                    user_id=db_manager.get_user_id(st.session_state['username']),
-                    hotel_name=hotel_data['name'],
-                    hotel_id=hotel_data['property_token'],
-                    city=params['destination'],
-                    check_in=params['check_in'].strftime("%Y-%m-%d"),
-                    check_out=params['check_out'].strftime("%Y-%m-%d"),
-                    room_type="Standard Room",
-                    total_price=total_price
-                )
-                if booking_id:
-                    st.session_state['transaction_id'] = transaction_id
-                    st.session_state['booking_id'] = booking_id
-                    st.session_state['show_payment'] = False
-                    st.session_state['show_confirmation'] = True
-                    st.session_state['selected_hotel'] = None
-                    st.rerun()
-                else:
-                    st.markdown('<div class="error-message">Failed to save booking. Please try again.</div>', unsafe_allow_html=True)
+                st.session_state['payment_job'] = get_payment_executor().submit(
+                    run_payment_job, get_payment_processor(), st.session_state['username'], dict(hotel_data), dict(params), rooms, total_price,
+                    {"card_number": card_number, "expiry": expiry, "cvv": cvv, "cardholder": cardholder})
+                st.rerun()
+
+# Polls the running payment job once a second without re-executing the rest of the page
+@st.fragment(run_every=1)
+def payment_status_fragment():
+    job = st.session_state.get('payment_job')
+    if job is None:
+        return
+    if not job.done():
+        st.info("⏳ Processing payment...")
+        return
+    st.session_state['payment_job'] = None
+    result = job.result()
+    hotel_data = st.session_state['selected_hotel']
+    params = st.session_state['booking_params']
+    if 'booking_id' in result:
+        st.session_state['transaction_id'] = result['transaction_id']
+        st.session_state['booking_id'] = result['booking_id']
+        st.session_state['show_payment'] = False
+        st.session_state['show_confirmation'] = True
+        st.session_state['selected_hotel'] = None
+    elif result['error'] == "rooms_unavailable":
+        hotel_data['available_rooms'] = db_manager.get_available_rooms([hotel_data['property_token']], params['check_in'].strftime("%Y-%m-%d"), params['check_out'].strftime("%Y-%m-%d")).get(hotel_data['property_token'], 0)
+        st.session_state['payment_error'] = f"Sorry, only {hotel_data['available_rooms']} room(s) are left for these dates. Please change the number of rooms or pick another hotel."
+    elif result['error'] == "declined":
+        st.session_state['payment_error'] = "Your card was declined. Please use a different card."
+    else:
+        st.session_state['payment_error'] = "Failed to save booking. Please try again."
+    st.rerun()
 
 def show_confirmation_page():
     st.markdown('<h2 class="subheader">🎉 Booking Confirmed!</h2>', unsafe_allow_html=True)
@@ -831,18 +1187,27 @@ def my_bookings_page():
 # Chat Page
 def chat_page(groq_client):
     st.markdown('<h2 class="subheader">💬 Chat with Travel Bot</h2>', unsafe_allow_html=True)
+    chat_fragment(groq_client)
+
+# Runs as a fragment: sending a message or clearing the chat re-executes only this function,
+# not the sidebar, DB setup or search page
+@st.fragment
+def chat_fragment(groq_client):
+    # conversation_history is append-only; only the newest CHAT_RENDER_WINDOW messages are drawn
+    if not st.session_state['conversation_history']:
+        st.session_state['conversation_history'].append({"role": "assistant", "content": 
+            "Hi! I'm your travel assistant. How can I help you today?"})
 
+    history = st.session_state['conversation_history']
     chat_container = st.container()
     with chat_container:
-        for msg in st.session_state['conversation_history']:
+        hidden = len(history) - CHAT_RENDER_WINDOW
+        if hidden > 0:
+            st.caption(f"{hidden} earlier message(s) not shown")
+        for msg in history[max(hidden, 0):]:
             with st.chat_message(msg["role"]):
                 st.write(msg["content"])
 
-    if not st.session_state['conversation_history']:
-        st.session_state['conversation_history'].append({"role": "assistant", "content": 
-            "Hi! I'm your travel assistant. How can I help you today?"})
-        st.rerun()
-
     user_input = st.chat_input("Type your message here...")
     if user_input:
         st.session_state['conversation_history'].append({"role": "user", "content": user_input})
@@ -864,7 +1229,7 @@ def chat_page(groq_client):
                     try:
                         # Insert system message for concise answers
                         concise_system_message = {"role": "system", "content": "Answer concisely and to the point, only include important information or main points."}
-                        messages = [concise_system_message] + st.session_state['conversation_history']
+                        messages = [concise_system_message] + st.session_state['conversation_history'][-CHAT_CONTEXT_MESSAGES:]
                         response = groq_client.chat.completions.create(
                             model="llama-3.3-70b-versatile",
                             messages=messages,
@@ -889,7 +1254,7 @@ def chat_page(groq_client):
     if st.button("🗑️ Clear Chat", key="clear_chat_button"):
         st.session_state['conversation_history'] = [{"role": "assistant", "content": "Conversation cleared."}]
         st.session_state['booking_state'] = "idle"
-        st.rerun()
+        st.rerun(scope="fragment")
 
 # Handle Booking Chat Logic
 def handle_booking_chat(user_input, google_hotels_client):
@@ -942,12 +1307,12 @@ def handle_booking_chat(user_input, google_hotels_client):
             else:
                 st.session_state['booking_params']['rooms'] = rooms
                 st.session_state['booking_state'] = "idle"
-                search_results = google_hotels_client.search_hotels(
-                    q=st.session_state['booking_params']['destination'],
-                    check_in_date=st.session_state['booking_params']['check_in'].strftime("%Y-%m-%d"),
-                    check_out_date=st.session_state['booking_params']['check_out'].strftime("%Y-%m-%d"),
-                    adults=st.session_state['booking_params']['num_people']
-                )
+                search_results = search_hotels_cached({
+                    "q": st.session_state['booking_params']['destination'],
+                    "check_in_date": st.session_state['booking_params']['check_in'].strftime("%Y-%m-%d"),
+                    "check_out_date": st.session_state['booking_params']['check_out'].strftime("%Y-%m-%d"),
+                    "adults": st.session_state['booking_params']['num_people']
+                })
                 st.session_state['search_results'] = search_results.get("properties", []) if search_results else []
                 st.session_state['booking_params'] = {k: None for k in st.session_state['booking_params']}
                 return "Check the 'Search Hotels' page for results."
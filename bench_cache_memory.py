@@ -0,0 +1,114 @@
+"""Memory benchmark for the search response cache.
+
+Builds 100k synthetic Google Hotels properties (5,000 responses of 20 properties, shaped like
+SerpApi output) and compares the memory held by plain parsed dicts with CompactSearchResult,
+plus the cost of expanding a compact entry back into a response.
+
+    python bench_cache_memory.py [--properties 100000] [--per-response 20]
+"""
+import argparse
+import json
+import os
+import random
+import time
+import tracemalloc
+
+os.environ.setdefault("SERPAPI_KEY", "benchmark")
+
+from api import CompactSearchResult
+
+AMENITIES = ["Free Wi-Fi", "Free breakfast", "Free parking", "Pool", "Air conditioning", "Fitness centre",
+             "Spa", "Bar", "Restaurant", "Room service", "Kitchen in some rooms", "Airport shuttle",
+             "Full-service laundry", "Accessible", "Business centre", "Child-friendly", "Pet-friendly"]
+SOURCES = ["Booking.com", "Agoda", "Expedia", "Hotels.com", "MakeMyTrip", "Goibibo", "Trip.com"]
+CITIES = ["Goa", "Mumbai", "Delhi", "Jaipur", "Bengaluru", "Chennai", "Kochi", "Udaipur", "Pune", "Agra"]
+
+
+def make_property(rng, hotel_id, city):
+    price = rng.randint(900, 25000)
+    hotel_class = rng.randint(1, 5)
+    return {
+        "type": "hotel",
+        "name": f"{city} {rng.choice(['Grand', 'Royal', 'Palm', 'Bay', 'Heritage'])} Hotel {hotel_id}",
+        "description": f"Relaxed {hotel_class}-star hotel in {city} with {rng.choice(AMENITIES).lower()} and "
+                       f"{rng.choice(AMENITIES).lower()}, a short walk from the centre.",
+        "link": f"https://www.example-hotel-{hotel_id}.com/",
+        "property_token": f"ChkI{hotel_id:012d}QhAaDS9nLzExZ{hotel_id % 97:02d}EAE",
+        "serpapi_property_details_link": f"https://serpapi.com/search.json?engine=google_hotels&property_token=ChkI{hotel_id:012d}",
+        "gps_coordinates": {"latitude": round(rng.uniform(8, 32), 6), "longitude": round(rng.uniform(68, 92), 6)},
+        "check_in_time": "2:00 PM",
+        "check_out_time": "12:00 PM",
+        "rate_per_night": {"lowest": f"₹{price:,}", "extracted_lowest": price,
+                           "before_taxes_fees": f"₹{int(price * 0.85):,}", "extracted_before_taxes_fees": int(price * 0.85)},
+        "total_rate": {"lowest": f"₹{price * 2:,}", "extracted_lowest": price * 2,
+                       "before_taxes_fees": f"₹{int(price * 1.7):,}", "extracted_before_taxes_fees": int(price * 1.7)},
+        "prices": [{"source": source, "logo": f"https://www.gstatic.com/travel/{source.lower()}.png",
+                    "rate_per_night": {"lowest": f"₹{price + i * 120:,}", "extracted_lowest": price + i * 120}}
+                   for i, source in enumerate(rng.sample(SOURCES, 3))],
+        "nearby_places": [{"name": f"{city} {place}", "transportations": [{"type": "Taxi", "duration": f"{rng.randint(3, 40)} min"}]}
+                          for place in rng.sample(["Airport", "Railway Station", "Beach", "Fort", "Market"], 2)],
+        "hotel_class": f"{hotel_class}-star hotel",
+        "extracted_hotel_class": hotel_class,
+        "images": [{"thumbnail": f"https://lh5.googleusercontent.com/p/AF1Qip{hotel_id:08d}{i}=s287-w287-h192-n-k-no-v1",
+                    "original_image": f"https://example-cdn.com/hotels/{hotel_id}/{i}.jpg"} for i in range(4)],
+        "overall_rating": round(rng.uniform(2.5, 5.0), 1),
+        "reviews": rng.randint(10, 9000),
+        "ratings": [{"stars": stars, "count": rng.randint(0, 2000)} for stars in range(5, 0, -1)],
+        "location_rating": round(rng.uniform(2.0, 5.0), 1),
+        "amenities": rng.sample(AMENITIES, 8),
+        "excluded_amenities": rng.sample(AMENITIES, 2),
+    }
+
+
+def make_responses(total, per_response):
+    rng = random.Random(42)
+    responses = []
+    for start in range(0, total, per_response):
+        city = CITIES[(start // per_response) % len(CITIES)]
+        responses.append({
+            "search_metadata": {"id": f"{start:024x}", "status": "Success", "total_time_taken": 1.32},
+            "search_parameters": {"engine": "google_hotels", "q": city, "gl": "in", "hl": "en", "currency": "INR",
+                                  "check_in_date": "2026-12-01", "check_out_date": "2026-12-03", "adults": 2},
+            "properties": [make_property(rng, hotel_id, city) for hotel_id in range(start, min(start + per_response, total))],
+        })
+    return responses
+
+
+def measure(build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    held = build()
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return held, current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--properties", type=int, default=100000)
+    parser.add_argument("--per-response", type=int, default=20)
+    args = parser.parse_args()
+
+    # Responses as received over the wire; timings below include tracemalloc overhead
+    payloads = [json.dumps(r) for r in make_responses(args.properties, args.per_response)]
+    # Each representation is built straight from the payloads so neither shares strings with the other
+    compact, compact_bytes, compact_time = measure(lambda: [CompactSearchResult.from_response(json.loads(p)) for p in payloads])
+    plain, plain_bytes, plain_time = measure(lambda: [json.loads(p) for p in payloads])
+
+    sample = compact[: min(500, len(compact))]
+    started = time.perf_counter()
+    for entry in sample:
+        entry.to_response()
+    expand_ms = (time.perf_counter() - started) / len(sample) * 1000
+    assert compact[0].to_response() == plain[0], "round trip changed the response"
+
+    print(f"properties:          {args.properties:,} in {len(plain):,} responses")
+    print(f"plain dict cache:    {plain_bytes / 1e6:8.1f} MB  ({plain_bytes / args.properties:,.0f} B/property, parsed in {plain_time:.2f}s)")
+    print(f"compact cache:       {compact_bytes / 1e6:8.1f} MB  ({compact_bytes / args.properties:,.0f} B/property, built in {compact_time:.2f}s)")
+    print(f"reduction:           {plain_bytes / compact_bytes:8.1f}x")
+    print(f"expand one response: {expand_ms:8.2f} ms ({args.per_response} properties)")
+
+
+if __name__ == "__main__":
+    main()
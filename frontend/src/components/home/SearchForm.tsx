@@ -1,5 +1,5 @@
 
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { format } from 'date-fns';
 import { Calendar as CalendarIcon, Search, Users, MapPin } from 'lucide-react';
@@ -20,6 +20,7 @@ import {
 } from '@/components/ui/select';
 import { Input } from '@/components/ui/input';
 import { motion } from 'framer-motion';
+import { getDestinationSuggestions } from '@/lib/api';
 
 const popularLocations = [
   { value: "maldives", label: "Maldives" },
@@ -38,6 +39,30 @@ const SearchForm = () => {
   const [guests, setGuests] = useState("2");
   const [isAdvancedOpen, setIsAdvancedOpen] = useState(false);
   const [showSuggestions, setShowSuggestions] = useState(false);
+  const [suggestions, setSuggestions] = useState<{ value: string; label: string }[] | null>(null);
+
+  // Ask the backend for canonical destinations once typing pauses; fall back to the static list on error
+  useEffect(() => {
+    const prefix = location.trim();
+    if (!prefix) {
+      setSuggestions(null);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(() => {
+      getDestinationSuggestions(prefix)
+        .then((found) => {
+          if (!cancelled) setSuggestions(found.map((s) => ({ value: s.destination, label: s.label })));
+        })
+        .catch(() => {
+          if (!cancelled) setSuggestions(null);
+        });
+    }, 150);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [location]);
 
   const handleSearch = (e: React.FormEvent) => {
     e.preventDefault();
@@ -63,7 +88,7 @@ const SearchForm = () => {
   };
 
   // Filter locations based on input
-  const filteredLocations = popularLocations.filter(loc => 
+  const filteredLocations = suggestions ?? popularLocations.filter(loc => 
     loc.label.toLowerCase().includes(location.toLowerCase())
   );
 
@@ -98,7 +123,7 @@ const SearchForm = () => {
                     <li 
                       key={loc.value}
                       className="px-4 py-2 hover:bg-gray-100 cursor-pointer text-gray-700"
-                      onClick={() => selectSuggestion(loc.label)}
+                      onClick={() => selectSuggestion(suggestions ? loc.value : loc.label)}
                     >
                       {loc.label}
                     </li>
@@ -198,6 +198,90 @@ export const getHotelDetailsByToken = async (
   }
 };
 
+export interface SimilarHotel {
+  property_token: string;
+  name: string;
+  rate_per_night: number | null;
+  overall_rating: number | null;
+  hotel_class: number | null;
+  thumbnail: string | null;
+  similarity: number;
+}
+
+// Hotels in the same destination with similar amenities, price, rating and location.
+// Resolves to an empty list when the hotel has not appeared in a recent search.
+export const getSimilarHotels = async (token: string, k: number = 4): Promise<SimilarHotel[]> => {
+  try {
+    const response = await apiRequest<{ similar: SimilarHotel[] }>(`/hotel_detail/${token}/similar?k=${k}`);
+    return response.similar;
+  } catch (error) {
+    return [];
+  }
+};
+
+export interface NearbyHotel {
+  property_token: string;
+  name: string;
+  destination: string | null;
+  latitude: number;
+  longitude: number;
+  rate_per_night: number | null;
+  overall_rating: number | null;
+  hotel_class: number | null;
+  thumbnail: string | null;
+  updated_at: string;
+  distance_km: number;
+}
+
+export type NearbyQuery =
+  | { lat: number; lng: number; radius_km?: number }
+  | { south: number; north: number; west: number; east: number };
+
+// Hotels already seen in earlier searches, either around a point or inside a map viewport.
+export const getNearbyHotels = async (query: NearbyQuery, limit: number = 50): Promise<NearbyHotel[]> => {
+  const params = new URLSearchParams({ limit: String(limit) });
+  Object.entries(query).forEach(([key, value]) => {
+    if (value !== undefined) params.append(key, String(value));
+  });
+  const response = await apiRequest<{ hotels: NearbyHotel[] }>(`/hotels/nearby?${params.toString()}`);
+  return response.hotels;
+};
+
+export interface TextSearchHotel {
+  property_token: string;
+  name: string;
+  destination: string | null;
+  address: string | null;
+  rate_per_night: number | null;
+  overall_rating: number | null;
+  hotel_class: number | null;
+  thumbnail: string | null;
+  updated_at: string;
+  snippet: string | null;
+  score: number;
+}
+
+// Ranked keyword search ("pool breakfast near airport") over hotels seen in earlier searches.
+export const searchHotelsByText = async (q: string, destination?: string, limit: number = 20): Promise<TextSearchHotel[]> => {
+  const params = new URLSearchParams({ q, limit: String(limit) });
+  if (destination) params.append('destination', destination);
+  const response = await apiRequest<{ hotels: TextSearchHotel[] }>(`/hotels/text_search?${params.toString()}`);
+  return response.hotels;
+};
+
+export interface DestinationSuggestion {
+  destination: string;
+  label: string;
+  searches: number;
+}
+
+// Canonical destination names for a typed prefix; searching with `destination` reuses cached results.
+export const getDestinationSuggestions = async (prefix: string, limit: number = 8): Promise<DestinationSuggestion[]> => {
+  const params = new URLSearchParams({ prefix, limit: String(limit) });
+  const response = await apiRequest<{ suggestions: DestinationSuggestion[] }>(`/destinations/suggest?${params.toString()}`);
+  return response.suggestions;
+};
+
 // Deprecate or remove the old getHotelById if no longer needed,
 // or update it to use getHotelDetailsByToken if the 'id' it receives is always a property_token.
 // For now, let's keep it but log a warning if it's used.
@@ -225,10 +309,13 @@ export const createBooking = async (
   check_out: string,
   room_type: string,
   total_price: number,
-  payment: PaymentDetails
+  payment: PaymentDetails,
+  idempotencyKey: string // Create once per booking and reuse it on every retry, so the booking is only made once
 ): Promise<{ message: string, booking_id: number, transaction_id: number }> => {
-  return apiRequest('/bookings', {
+  // The booking is accepted as a background payment job; poll its status until it finishes
+  const { job_id } = await apiRequest<{ job_id: string }>('/bookings', {
     method: 'POST',
+    headers: { 'Idempotency-Key': idempotencyKey },
     body: JSON.stringify({
       user_id,
       hotel_name,
@@ -241,6 +328,29 @@ export const createBooking = async (
       payment
     }),
   });
+  for (;;) {
+    const job = await getBookingJob(job_id);
+    if (job.status === 'succeeded') {
+      return job.result as { message: string, booking_id: number, transaction_id: number };
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.result?.error || 'Booking failed');
+    }
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+  }
+};
+
+export interface BookingJob {
+  job_id: string;
+  status: 'queued' | 'processing' | 'succeeded' | 'failed';
+  status_code: number | null;
+  result: any;
+  created_at: string;
+  updated_at: string;
+}
+
+export const getBookingJob = async (job_id: string): Promise<BookingJob> => {
+  return apiRequest(`/bookings/jobs/${job_id}`);
 };
 
 // Chat API
@@ -1,8 +1,8 @@
 
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { useParams, useNavigate, useLocation } from 'react-router-dom'; // Added useLocation
 import { motion } from 'framer-motion';
-import { Hotel, getHotelDetailsByToken, createBooking, getHotelDetailsBySerpLink } from '@/lib/api'; // Added getHotelDetailsBySerpLink
+import { Hotel, SimilarHotel, getHotelDetailsByToken, createBooking, getHotelDetailsBySerpLink, getSimilarHotels } from '@/lib/api'; // Added getHotelDetailsBySerpLink
 import { Calendar } from '@/components/ui/calendar';
 import { Button } from '@/components/ui/button';
 import { Badge } from '@/components/ui/badge';
@@ -45,6 +45,9 @@ const HotelDetail = () => {
   const [guests, setGuests] = useState("2");
   const [isBooking, setIsBooking] = useState(false);
   const [showPaymentForm, setShowPaymentForm] = useState(false); 
+  const [similarHotels, setSimilarHotels] = useState<SimilarHotel[]>([]);
+  // One Idempotency-Key per booking attempt: reused on retries, replaced once the booking details change or it succeeds
+  const bookingAttempt = useRef<{ details: string; key: string } | null>(null);
   const { toast } = useToast();
   const { user, isAuthenticated } = useAuth(); 
   const navigate = useNavigate();
@@ -107,6 +110,11 @@ const HotelDetail = () => {
     fetchHotel();
   }, [id, toast, location.state, checkIn, checkOut]); // Added location.state, checkIn, checkOut to dependencies
 
+  useEffect(() => {
+    if (!id) return;
+    getSimilarHotels(id).then(setSimilarHotels);
+  }, [id]);
+
   const handleBooking = async () => { // This will now toggle payment form
     if (!hotel || !id || !user) { 
         toast({ title: "Error", description: "User or hotel data missing.", variant: "destructive" });
@@ -130,12 +138,20 @@ const HotelDetail = () => {
     const serviceFee = 30;  
     const calculatedTotalPrice = basePrice + cleaningFee + serviceFee;
 
+    const booking = [
+      user.id, hotel.name, hotel.id, hotel.location,
+      format(checkIn, 'yyyy-MM-dd'), format(checkOut, 'yyyy-MM-dd'),
+      "Standard Room", calculatedTotalPrice, paymentDetails
+    ] as const;
+    const details = JSON.stringify(booking);
+    const attempt = bookingAttempt.current?.details === details
+      ? bookingAttempt.current
+      : { details, key: crypto.randomUUID() };
+    bookingAttempt.current = attempt;
+
     try {
-      await createBooking(
-        user.id, hotel.name, hotel.id, hotel.location,
-        format(checkIn, 'yyyy-MM-dd'), format(checkOut, 'yyyy-MM-dd'),
-        "Standard Room", calculatedTotalPrice, paymentDetails
-      );
+      await createBooking(...booking, attempt.key);
+      bookingAttempt.current = null;
       toast({ title: "Booking confirmed!", description: `Your stay at ${hotel.name} has been booked.` });
       setShowPaymentForm(false); // Hide payment form
       setTimeout(() => navigate("/dashboard"), 2000);
@@ -287,6 +303,37 @@ const HotelDetail = () => {
                 </div>
               </section>
 
+              {similarHotels.length > 0 && (
+                <>
+                  <Separator />
+
+                  <section>
+                    <h2 className="font-serif text-2xl font-semibold mb-4">Similar hotels</h2>
+                    <div className="grid grid-cols-1 sm:grid-cols-2 gap-4">
+                      {similarHotels.map((similar) => (
+                        <button
+                          key={similar.property_token}
+                          type="button"
+                          onClick={() => navigate(`/hotel/${similar.property_token}`)}
+                          className="flex items-center gap-3 rounded-lg border p-3 text-left hover:bg-gray-50"
+                        >
+                          {similar.thumbnail && (
+                            <img src={similar.thumbnail} alt={similar.name} loading="lazy" className="h-16 w-16 rounded object-cover" />
+                          )}
+                          <div>
+                            <p className="font-medium">{similar.name}</p>
+                            <p className="text-sm text-gray-600">
+                              {similar.overall_rating ? `★ ${similar.overall_rating}` : ''}
+                              {similar.rate_per_night ? ` · ₹${similar.rate_per_night.toLocaleString()} / night` : ''}
+                            </p>
+                          </div>
+                        </button>
+                      ))}
+                    </div>
+                  </section>
+                </>
+              )}
+
               <Separator />
               
               <section>
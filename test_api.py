@@ -2,6 +2,7 @@ import requests
 import json
 from datetime import datetime, timedelta
 import sys
+import time
 
 # API base URL
 BASE_URL = "http://localhost:5000/api"
@@ -103,6 +104,38 @@ def test_search_hotels():
         print(f"Error during hotel search: {str(e)}")
         return None
 
+def test_search_many_hotels():
+    """Test multi-destination hotel search API"""
+    print("\n=== Testing Multi-Destination Hotel Search ===")
+    
+    try:
+        today = datetime.now()
+        check_in = today + timedelta(days=7)
+        check_out = check_in + timedelta(days=3)
+        
+        payload = {
+            "destinations": ["London", "Paris"],
+            "check_in_date": check_in.strftime("%Y-%m-%d"),
+            "check_out_date": check_out.strftime("%Y-%m-%d"),
+            "adults": 2
+        }
+        
+        response = requests.post(f"{BASE_URL}/hotels/search_many", json=payload)
+        print(f"Status Code: {response.status_code}")
+        
+        if response.status_code == 200:
+            results = response.json()
+            print(f"Partial: {results['partial']}")
+            for result in results["results"]:
+                print(f"  {result['destination']}: {result['status']} ({len(result.get('properties', []))} properties)")
+            return True
+        else:
+            print(f"Error response: {response.text}")
+            return False
+    except Exception as e:
+        print(f"Error during multi-destination search: {str(e)}")
+        return False
+
 def test_booking(user, hotel):
     """Test booking creation"""
     print("\n=== Testing Booking Creation ===")
@@ -144,8 +177,20 @@ def test_booking(user, hotel):
         print(f"Status Code: {response.status_code}")
         print(f"Response: {response.json()}")
         
-        if response.status_code == 201:
-            return response.json()
+        if response.status_code != 202:
+            return None
+        
+        # Payment runs as a background job; poll until it finishes
+        status_url = response.headers["Location"]
+        for _ in range(30):
+            job = requests.get(f"{BASE_URL}{status_url[len('/api'):]}").json()
+            if job["status"] not in ("queued", "processing"):
+                break
+            time.sleep(1)
+        print(f"Job: {job}")
+        
+        if job["status"] == "succeeded":
+            return job["result"]
         return None
     except Exception as e:
         print(f"Error during booking creation: {str(e)}")
@@ -203,6 +248,7 @@ def run_all_tests():
         "register": False,
         "login": False,
         "search": False,
+        "search_many": False,
         "booking": False,
         "get_bookings": False,
         "chat": False
@@ -224,6 +270,9 @@ def run_all_tests():
         hotel_data = test_search_hotels()
         test_results["search"] = bool(hotel_data)
         
+        # Test multi-destination search
+        test_results["search_many"] = test_search_many_hotels()
+        
         # Test booking creation
         booking_data = None
         if user_data and hotel_data: